@@ -1,19 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_socketio import SocketIO
-from inference_handler.input_handler import prepare_image_from_bytes, prepare_image_from_base64
-from inference_handler.model_loader import load_models, load_clip_model, update_config_yaml
+from inference_handler.input_handler import prepare_image_from_bytes, prepare_image_from_base64, prepare_image_from_jpeg
+from inference_handler.model_loader import ModelRegistry, load_clip_model, update_config_yaml, restore_config_yaml, get_label_prompts
 from inference_handler.output_handler import annotate_image, extract_combined_predictions
-from inference_handler.prediction_handler import return_top_prompts, suppress_highlights, model_name_list, models_to_run, run_best_yolo_models
+from inference_handler.video_handler import process_video, prune_videos
+from inference_handler.prediction_handler import return_top_prompts, select_models, run_best_yolo_models, gate_batch
+from inference_handler.prompt_cache import PromptEmbeddingCache, clip_model_id
+from inference_handler.preprocessing import ClipPreprocessor
+from inference_handler.tiling import TileGrid
+from inference_handler.clip_export import load_clip_backend
+from inference_handler.prompt_index import PromptIndex
+from inference_handler.embedding_index import PromptEmbeddingStore, build_prompt_embeddings, save_prompt_embeddings
+from inference_handler.temporal_cache import TemporalGateCache
+from inference_handler.result_cache import ResultCache, result_key, file_version
+from inference_handler.frame_scheduler import FrameScheduler
+from inference_handler.worker_pool import WorkerPool
+from inference_handler.batching import MicroBatcher, YoloBatchers
+from inference_handler.metrics import metrics
+from inference_handler.torch_threads import process_threads, set_process_threads, use_threads
 from utils.config_loader import load_config
 import os
-import cv2
-from PIL import Image
+import shutil
 import numpy as np
 import tempfile
 import base64
 import torch
 import json
-from flask_socketio import SocketIO
+import uuid
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 config = load_config()
@@ -21,6 +37,23 @@ config = load_config()
 model_paths = config["models"]
 text_prompt_list = config["text_prompts"]
 output = config["output"]
+clip_config = config["clip"]
+yolo_config = config["yolo"]
+batching_config = config["batching"]
+temporal_config = config["temporal_cache"]
+video_config = config["video"]
+video_dir = os.path.abspath(output["video_dir"])
+metrics.configure(config["metrics"]["enabled"])
+
+# The reloader parent of socketio.run(debug=True) only watches the files and serves nothing; its child
+# imports this module again and forks the worker pool:
+reloader_parent = __name__ == '__main__' and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+fork_workers = config["worker_pool"]["processes"] > 0 and not reloader_parent
+# OpenMP does not survive a fork: workers forked after the parent ran parallel torch work deadlock on their
+# first parallel op. Until the pool is forked, the server runs torch on one thread:
+torch_threads = process_threads()
+if fork_workers:
+    set_process_threads(1)
 
 from flask_cors import CORS
 app = Flask(__name__)
@@ -28,67 +61,334 @@ CORS(app)
 
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Pre-load once during startup:
-models = load_models(model_paths)
+# YOLO weights are loaded on first selection by the CLIP gate, CLIP is pre-loaded once during startup:
+models = ModelRegistry(model_paths, **config["registry"], backbone_signatures=yolo_config["shared_backbone"])
 clip_model, processor = load_clip_model()
+# Single resize -> highlight cap -> normalize stage for every CLIP image input:
+processor = ClipPreprocessor(processor, clip_config["highlight_threshold"], clip_config["batch_size"])
+# Optionally gate on the exported ONNX / TorchScript encoders (python -m inference_handler.clip_export):
+clip_model = load_clip_backend(
+    clip_model, processor, clip_config["backend"],
+    clip_config["export_dir"], clip_config["export_tolerance"]
+)
+# Text embeddings of the registered prompts are memory-mapped from the file written by
+# python -m inference_handler.embedding_index, only other prompts go through the text tower:
+prompt_cache = PromptEmbeddingCache(
+    clip_config["prompt_cache_size"], PromptEmbeddingStore.load(clip_config["embedding_index"])
+)
+
+# Optionally gate on a grid of crops plus the global view, for small objects in high-resolution frames:
+tiling_config = clip_config["tiling"]
+tile_grid = TileGrid(
+    *tiling_config["grid"], tiling_config["overlap"], tiling_config["aggregate"],
+    tiling_config["temperature"], tiling_config["include_global"]
+) if tiling_config["enabled"] else None
+
+# Reuses gating decisions (and optionally boxes) across near-identical webcam frames:
+temporal_cache = TemporalGateCache(
+    temporal_config["threshold"], temporal_config["max_age"],
+    temporal_config["max_entries"], enabled=temporal_config["enabled"]
+)
+
+# Coalesces the concurrent gating requests of all clients into one image-encoder forward,
+# and the frames that selected the same YOLO model into one predict call:
+gate_batcher = MicroBatcher(
+    lambda items: gate_batch(items, clip_model, processor, clip_config["batch_size"], tile_grid),
+    batching_config["max_batch_size"], batching_config["max_wait_ms"], name="clip"
+) if batching_config["enabled"] else None
+yolo_batchers = YoloBatchers(
+    models, batching_config["max_batch_size"], batching_config["max_wait_ms"]
+) if batching_config["enabled"] else None
+
+
+def build_prompt_index(config, new_models=None):
+    """
+    Builds the gating index from the per-model prompts and, for the models listed under
+    label_prompts, one prompt per YOLO class so that only the significant classes are detected.
+    new_models holds loaded models that are not in the registry yet.
+    """
+    new_models = new_models or {}
+    label_prefixes = config.get("label_prompts") or {}
+    label_prompts = get_label_prompts(
+        {name: new_models[name] if name in new_models else models[name] for name in label_prefixes}, label_prefixes
+    )
+    return PromptIndex.from_text_prompts(config["text_prompts"], label_prompts)
+
+
+# Gating prompts of every registered model, rebuilt whenever a model is added:
+prompt_index = build_prompt_index(config)
+
+# An embedding file written for other prompts or another checkpoint is brought up to date on startup,
+# encoding only the prompts it does not hold yet:
+if prompt_cache.precomputed is not None and not prompt_cache.precomputed.matches(prompt_index, clip_model_id(clip_model)):
+    print(f"{clip_config['embedding_index']} does not hold the registered prompts, updating it")
+    try:
+        prompt_cache.precomputed = build_prompt_embeddings(
+            clip_config["embedding_index"], prompt_index, clip_model, processor, prompt_cache
+        )
+        prompt_cache.clear()
+        prompt_index = build_prompt_index(config)
+    except OSError as error:
+        print(f"Could not update {clip_config['embedding_index']}: {error}")
+
+# Built before the worker pool is forked, so the workers share the text features copy-on-write:
+prompt_index.search_index(clip_model, processor, prompt_cache, **clip_config["prompt_search"])
+
+
+def build_model_version():
+    """
+    Version of everything a cached result depends on besides the request itself:
+    the YOLO weights on disk, the CLIP checkpoint, the gating prompts, the tiling and prompt search settings.
+    """
+    return result_key(
+        b"", file_version(models.paths().values()), clip_model_id(clip_model),
+        prompt_index.prompt_to_model_dict, prompt_index.prompt_class_ids.tolist(),
+        tiling_config if tile_grid is not None else None, clip_config["prompt_search"]
+    )
+
+
+# Responses of /predict and /predict_image keyed by image content, prompts and model version:
+result_cache = ResultCache(**config["result_cache"])
+model_version = build_model_version()
+
+
+def gate_prompts(image, prompt_list):
+    """
+    CLIP probabilities of the prompts on one image, as JSON-serializable floats.
+    """
+    prompt_to_prob_dict = return_top_prompts(
+        image, prompt_list, prompt_index.prompt_to_model_dict, clip_model, processor, False, prompt_cache, tile_grid, gate_batcher
+    )
+
+    with metrics.stage("encode"):
+        return tensor_to_json_serializable(prompt_to_prob_dict)
+
+
+def detect_objects(image, model_classes=None):
+    """
+    Runs the YOLO models selected by the CLIP gate on one image. A previous gating decision
+    can be passed as model_classes to skip the gate. Returns (model_classes, detections).
+    """
+    if model_classes is None:
+        model_classes = select_models(
+            image, prompt_index, clip_model, processor, prompt_cache, tile_grid, gate_batcher, clip_config["prompt_search"]
+        )
 
-prompt_to_model_dict = {
-    # Human face
-    "A photo of a person's face": models["face_detection"],
+    predictions = run_best_yolo_models(
+        image, models, list(model_classes), output["confidence"], yolo_config["workers"], model_classes,
+        yolo_config["shared_backbone"], yolo_config["min_shared_layers"], yolo_batchers
+    )
+
+    with metrics.stage("encode"):
+        return model_classes, extract_combined_predictions(predictions, model_classes)
+
+
+def annotate_video(video_path, output_path, prompt_list):
+    return process_video(
+        video_path, output_path, prompt_list,
+        clip_model, processor, video_config["change_threshold"], video_config["max_gap_seconds"],
+        clip_config["batch_size"], video_config["max_buffered_frames"], prompt_cache, tile_grid
+    )
+
+
+def prepare_model_index(model_name, model, model_config=None):
+    """
+    Builds the gating index of the registry with the model added (from model_config, by default
+    the config file) and encodes its prompts, without touching the live registry or index.
+    """
+    new_index = build_prompt_index(model_config or load_config(), {model_name: model})
+    new_index.search_index(clip_model, processor, prompt_cache, **clip_config["prompt_search"])
+    return new_index
+
+
+def register_model(model_name, path, model=None, new_index=None):
+    """
+    Hot-registers a YOLO model in this process: loads and validates the weights (unless already loaded),
+    builds the new gating index and encodes its prompts (unless already built), then swaps the model and the index in.
+    Requests in flight keep the index they started with and are never blocked by the registration.
+    """
+    global prompt_index
+    if model is None:
+        model = models.load_weights(path)
+    if new_index is None:
+        new_index = prepare_model_index(model_name, model)
+
+    with registration_lock:
+        models.register(model_name, path, model)
+        prompt_index = new_index
+
+
+def unregister_model(model_name):
+    """
+    Removes a YOLO model from this process and rebuilds the gating index from the config file.
+    """
+    global prompt_index
+    new_index = build_prompt_index(load_config())
+    new_index.search_index(clip_model, processor, prompt_cache, **clip_config["prompt_search"])
+
+    with registration_lock:
+        models.unregister(model_name)
+        prompt_index = new_index
+
+
+registration_lock = threading.Lock()
+
+
+# Model-bound work, run in a forked worker process when the worker pool is enabled:
+INFERENCE_TASKS = {
+    "gate_prompts": gate_prompts,
+    "detect_objects": detect_objects,
+    "annotate_video": annotate_video,
+    "register_model": register_model,
+    "unregister_model": unregister_model,
 }
+worker_pool = None
+
+
+def run_inference(task, *args):
+    if worker_pool is not None:
+        return worker_pool.run(task, *args)
+    return INFERENCE_TASKS[task](*args)
+
+
+def process_frame(sid, data):
+    """
+    Runs CLIP (with prompts) or the gated YOLO models (without) on one webcam frame of a session.
+    Called on the frame scheduler's worker pool, returns the "prediction" event payload.
+    """
+    with metrics.timer("inference_request_seconds", path="frame"):
+        return _process_frame(sid, data)
 
-@socketio.on('frame')
-def handle_frame(data):
-    if not data["image"]:
-        return jsonify({"error": "No image received!"})
-    
-    img_base64 = data["image"]
-    image = prepare_image_from_base64(img_base64)
+
+def _process_frame(sid, data):
+    # Binary frames arrive as raw JPEG bytes, the original protocol sends a base64 data URL:
+    if isinstance(data["image"], (bytes, bytearray)):
+        image = prepare_image_from_jpeg(data["image"])
+    else:
+        image = prepare_image_from_base64(data["image"])
 
     if data["prompts"]:
         prompt_list = data["prompts"]
-        image_np = np.array(image)
-
-        highlight_fixed = suppress_highlights(image_np, threshold=194)
-            
-        final_image = Image.fromarray(highlight_fixed)
 
-        prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, processor, True)
+        cache_key = (sid, "clip", tuple(prompt_list))
+        prompt_to_prob_dict, signature = temporal_cache.lookup(cache_key, image)
 
-        prompt_to_prob_dict = tensor_to_json_serializable(prompt_to_prob_dict)
+        if prompt_to_prob_dict is None:
+            prompt_to_prob_dict = run_inference("gate_prompts", image, prompt_list)
+            temporal_cache.store(cache_key, signature, prompt_to_prob_dict)
         
-        socketio.emit("prediction", {
+        return {
             "type": "clip",
             "data": prompt_to_prob_dict
-        })
-
-        return jsonify({"status": "frame received"}) 
+        }
     else:
-        prompt_list = [
-        ]
-        
-        image_np = np.array(image)
-
-        highlight_fixed = suppress_highlights(image_np, threshold=194)
-            
-        final_image = Image.fromarray(highlight_fixed)
+        # Either the boxes themselves or only the gating decision are reused while the scene is unchanged:
+        reuse_boxes = temporal_config["reuse_boxes"]
+        cache_key = (sid, "yolo" if reuse_boxes else "gate")
+        cached, signature = temporal_cache.lookup(cache_key, image)
 
-        prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, processor, True)
+        if reuse_boxes and cached is not None:
+            result_dict = cached
+        else:
+            model_classes, result_dict = run_inference("detect_objects", image, cached)
 
-        models_list = models_to_run(prompt_to_prob_dict, prompt_to_model_dict)
-        model_names = model_name_list(models_list, models)
+            if cached is None:
+                temporal_cache.store(cache_key, signature, result_dict if reuse_boxes else model_classes)
 
-        predictions = run_best_yolo_models(image, models, model_names, output["confidence"])
-        result_dict = extract_combined_predictions(predictions)
+        with metrics.stage("encode"):
+            result_dict = encode_detections(result_dict, image, data)
 
-        socketio.emit("prediction", {
+        return {
             "type": "yolo",
             "data": result_dict
-        })
+        }
+
+
+def encode_detections(detections, image, data):
+    """
+    Applies the optional frame metadata of the binary protocol: boxes are mapped back to
+    source_size ([width, height] of the frame before the client downscaled it) and, with packed,
+    returned as binary columns instead of JSON arrays.
+    """
+    source_size = data.get("source_size")
+    if source_size:
+        height, width = image.shape[:2] if isinstance(image, np.ndarray) else image.size[::-1]
+        scale_x, scale_y = source_size[0] / width, source_size[1] / height
+        if (scale_x, scale_y) != (1, 1):
+            detections = detections.rescaled(scale_x, scale_y)
+
+    if data.get("packed"):
+        return detections.pack()
+    return detections.to_json()
+
+
+def emit_prediction(sid, payload):
+    payload["dropped"] = frame_scheduler.dropped(sid)
+    socketio.emit("prediction", payload, to=sid)
+
+
+# Only the newest frame of each client is kept, inference runs off the socket loop:
+frame_scheduler = FrameScheduler(process_frame, emit_prediction, config["scheduler"]["workers"])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Request threads run the CLIP gate with the budget of the process (see torch_threads):
+    use_threads()
+
+
+@app.after_request
+def record_request_latency(response):
+    # Labelled by route rule rather than path, so that /videos/<name> stays a single series:
+    if request.url_rule is not None and request.endpoint != "get_metrics" and "request_start" in g:
+        metrics.observe("inference_request_seconds", time.perf_counter() - g.request_start, path=request.url_rule.rule)
+    return response
+
+
+@app.route('/metrics', methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def collect_component_metrics():
+    """
+    Counters kept by the caches, registry and scheduler, read at scrape time.
+    """
+    return [
+        ("inference_prompt_cache_hits_total", "counter", "Text-prompt embedding cache hits.", {}, prompt_cache.hits),
+        ("inference_prompt_cache_precomputed_hits_total", "counter", "Text-prompt embeddings read from the precomputed file.", {}, prompt_cache.precomputed_hits),
+        ("inference_prompt_cache_misses_total", "counter", "Text-prompt embedding cache misses.", {}, prompt_cache.misses),
+        ("inference_result_cache_hits_total", "counter", "Uploads answered from the result cache.", {"tier": "memory"}, result_cache.hits),
+        ("inference_result_cache_hits_total", "counter", "Uploads answered from the result cache.", {"tier": "disk"}, result_cache.disk_hits),
+        ("inference_result_cache_misses_total", "counter", "Uploads that were not in the result cache.", {}, result_cache.misses),
+        ("inference_temporal_cache_hits_total", "counter", "Webcam frames that reused a previous result.", {}, temporal_cache.hits),
+        ("inference_temporal_cache_misses_total", "counter", "Webcam frames that were gated from scratch.", {}, temporal_cache.misses),
+        ("inference_frames_dropped_total", "counter", "Webcam frames replaced by a newer frame before processing.", {}, frame_scheduler.total_dropped),
+        ("inference_frames_processed_total", "counter", "Webcam frames processed.", {}, frame_scheduler.processed),
+        ("inference_model_loads_total", "counter", "YOLO model weight loads.", {}, models.loads),
+        ("inference_model_evictions_total", "counter", "YOLO models evicted from memory.", {}, models.evictions),
+        ("inference_models_loaded", "gauge", "YOLO models currently resident.", {}, len(models.loaded_names())),
+    ]
+
+
+metrics.register_collector(collect_component_metrics)
+
+
+@socketio.on('frame')
+def handle_frame(data):
+    if not data["image"]:
+        return {"error": "No image received!"}
 
-        return jsonify({"status": "frame received"})
+    dropped = frame_scheduler.submit(request.sid, data)
+    return {"status": "frame received", "dropped": dropped}
 
 
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    frame_scheduler.remove(request.sid)
+    temporal_cache.drop(request.sid)
+
 
 @app.route('/predict', methods = ["POST"])
 def predict():
@@ -98,56 +398,66 @@ def predict():
     file = request.files["image"]
     prompts = request.form.get("prompts")
 
-    if prompts and json.loads(prompts) != [] and json.loads(prompts) != ['']:
-        prompt_list = json.loads(prompts)
-        image = prepare_image_from_bytes(file)
-        image_np = np.array(image)
+    payload = predict_payload(file, parse_prompts(prompts))
+    socketio.emit("prediction", payload)
 
-        highlight_fixed = suppress_highlights(image_np, threshold=194)
-            
-        final_image = Image.fromarray(highlight_fixed)
-        print("Prompt list:", prompt_list)
-        print("Image type:", type(final_image))
+    return jsonify({"status": "frame received"})
 
-        prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, processor, True)
 
-        prompt_to_prob_dict = tensor_to_json_serializable(prompt_to_prob_dict)
-        print(prompt_to_prob_dict)
-        socketio.emit("prediction", {
-            "type": "clip",
-            "data": prompt_to_prob_dict
-        })
+def parse_prompts(prompts):
+    """
+    Prompt list of a form field holding a JSON list, empty when no (non-blank) prompt was given.
+    """
+    if not prompts:
+        return []
+    prompt_list = json.loads(prompts)
+    return [] if prompt_list == [''] else prompt_list
 
-        return jsonify({"status": "frame received"})
 
-    else:
-       
-        prompt_list = [
-            "A photo of a person's face",
-        ]
+def predict_payload(file, prompt_list):
+    """
+    "prediction" event payload of an uploaded image: the CLIP probabilities of the prompts,
+    or the detections of the gated YOLO models when no prompts are given.
+    """
+    if prompt_list:
+        cache_key = upload_cache_key(file, "predict", prompt_list)
+        payload = result_cache.get(cache_key)
 
-        image = prepare_image_from_bytes(file)
-        image_np = np.array(image)
+        if payload is None:
+            image = prepare_image_from_bytes(file)
+            prompt_to_prob_dict = run_inference("gate_prompts", image, prompt_list)
+            payload = {
+                "type": "clip",
+                "data": prompt_to_prob_dict
+            }
+            result_cache.put(cache_key, payload)
 
-        highlight_fixed = suppress_highlights(image_np, threshold=194)
-            
-        final_image = Image.fromarray(highlight_fixed)
+    else:
+        cache_key = upload_cache_key(file, "predict", [], output["confidence"])
+        payload = result_cache.get(cache_key)
 
-        prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, processor, True)
+        if payload is None:
+            image = prepare_image_from_bytes(file)
 
-        models_list = models_to_run(prompt_to_prob_dict, prompt_to_model_dict)
-        model_names = model_name_list(models_list, models)
+            _, result_dict = run_inference("detect_objects", image)
 
-        predictions = run_best_yolo_models(image, models, model_names, output["confidence"])
+            payload = {
+                "type": "yolo",
+                "data": result_dict.to_json()
+            }
+            result_cache.put(cache_key, payload)
+
+    return payload
 
-        result_dict = extract_combined_predictions(predictions)
-        
-        socketio.emit("prediction", {
-            "type": "yolo",
-            "data": result_dict
-        })
 
-        return jsonify({"status": "frame received"})
+def upload_cache_key(file, *parts):
+    """
+    Result cache key of an uploaded image: its bytes, the request parameters and the current model version.
+    The upload stream is rewound so that the image can still be decoded on a miss.
+    """
+    image_bytes = file.stream.read()
+    file.stream.seek(0)
+    return result_key(image_bytes, model_version, *parts)
  
 
 # Predicting only with prompts:
@@ -157,33 +467,42 @@ def predict_image():
         return jsonify({"error": "No image uploaded!"}), 400 
     
     file = request.files["image"]
-    prompts = request.form.get("prompts")
+    prompt_list = parse_prompts(request.form.get("prompts"))
+
+    if prompt_list:
+        return jsonify(predict_image_response(file, prompt_list))
+
+    else:
+        return jsonify({"error": "No Prompts Given!"})
 
 
-    if json.loads(prompts) != [] and json.loads(prompts) != ['']:
-        prompt_list = json.loads(prompts)
-        image = prepare_image_from_bytes(file)
-        image_np = np.array(image)
+def predict_image_response(file, prompt_list):
+    """
+    /predict_image response of an uploaded image: the image annotated with the CLIP probabilities of the prompts.
+    """
+    cache_key = upload_cache_key(file, "predict_image", prompt_list)
+    response = result_cache.get(cache_key)
+    if response is not None:
+        return response
 
-        highlight_fixed = suppress_highlights(image_np, threshold=194)
-            
-        final_image = Image.fromarray(highlight_fixed)
+    image = prepare_image_from_bytes(file)
 
-        prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, processor, True)
+    prompt_to_prob_dict = run_inference("gate_prompts", image, prompt_list)
 
+    with metrics.stage("annotate"):
         buffer = annotate_image(image, prompt_to_prob_dict)
+
+    with metrics.stage("encode"):
         img_bytes = buffer.read()
         img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-        
-        prompt_to_prob_dict = tensor_to_json_serializable(prompt_to_prob_dict)
-        return jsonify({
-            "mediaType": "image",
-            "image": img_base64,
-            "prediction": prompt_to_prob_dict
-            })
 
-    else:
-        return jsonify({"error": "No Prompts Given!"})
+    response = {
+        "mediaType": "image",
+        "image": img_base64,
+        "prediction": prompt_to_prob_dict
+    }
+    result_cache.put(cache_key, response)
+    return response
 
 
 def tensor_to_json_serializable(d):
@@ -197,63 +516,53 @@ def predict_video():
 
     video_file = request.files["video"]
     prompts = request.form.get("prompts")
-    print(json.loads(prompts))
-
-    if json.loads(prompts) != [] and json.loads(prompts) != ['']:
-        prompt_list = json.loads(prompts)
-    else:
-        prompt_list = [
-            "A photo of a person's face",
-        ]
 
-    # Save uploaded video to a temporary file
+    # Stream the upload to a temporary file in chunks
     with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp:
-        temp.write(video_file.read())
+        video_file.save(temp)
         video_path = temp.name
 
-    # Extract frames using the saved path
-    video_frames = extract_frames(video_path, frame_interval=30)
-    if not video_frames:
-        return jsonify({"Error": "No frames extracted from video!"}), 400
+    response, status = annotate_uploaded_video(video_path, parse_prompts(prompts))
+    return jsonify(response), status
 
-    annotated_frames = []
 
-    for frame in video_frames:
-        frame_np = np.array(frame)
-        highlight_fixed = suppress_highlights(frame_np, 194)
-        final_image = Image.fromarray(highlight_fixed)
+def annotate_uploaded_video(video_path, prompt_list):
+    """
+    Annotates an uploaded video (deleted afterwards) into video_dir.
+    Returns the /predict_video response and its HTTP status code.
+    """
+    if not prompt_list:
+        prompt_list = [
+            "A photo of a person's face",
+        ]
 
-        prompt_to_prob_dict = return_top_prompts(
-            final_image, prompt_list, prompt_to_model_dict,
-            clip_model, processor, True
-        )
-        annotated_frame = annotate_frame(frame_np, prompt_to_prob_dict)
-        annotated_frames.append(annotated_frame)
-    
-    height, width, _ = annotated_frames[0].shape
-    fps = 10  
+    os.makedirs(video_dir, exist_ok=True)
+    prune_videos(video_dir, output["video_ttl_seconds"])
+
+    video_name = f"{uuid.uuid4().hex}.mp4"
+    output_path = os.path.join(video_dir, video_name)
 
-    output_path = tempfile.mktemp(suffix=".mp4")
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    try:
+        frame_count = run_inference("annotate_video", video_path, output_path, prompt_list)
+    finally:
+        os.remove(video_path)
 
-    for frame in annotated_frames:
-        out.write(frame)
-    out.release()
+    if frame_count == 0:
+        return {"Error": "No frames extracted from video!"}, 400
 
     if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-        return jsonify({"Error": "Video processing failed."}), 500
+        return {"Error": "Video processing failed."}, 500
 
-    with open(output_path, "rb") as f:
-        video_bytes = f.read()
-        video_base64 = base64.b64encode(video_bytes).decode("utf-8")
+    return {
+        "mediaType": "video",
+        "videoUrl": f"/videos/{video_name}"
+    }, 200
 
-    os.remove(output_path)
 
-    return jsonify({
-        "mediaType": "video",
-        "video": video_base64
-    })
+# Annotated videos are served from disk in chunks (with range requests) instead of inline base64:
+@app.route('/videos/<path:video_name>', methods=["GET"])
+def get_video(video_name):
+    return send_from_directory(video_dir, video_name, mimetype="video/mp4", conditional=True)
     
 
 @app.route('/add_model', methods = ["POST"])
@@ -266,49 +575,161 @@ def add_model():
     if not model_file or not model_name or not model_prompt:
         return jsonify({"error": "Missing model file or model name or model prompt"}), 400
 
-    save_path = os.path.join("models", f"{model_name}_best.pt")
-    model_file.save(save_path)
-
-    update_config_yaml(model_name, model_prompt)
+    upload_path = model_upload_path(model_name)
+    model_file.save(upload_path)
 
-    return jsonify({"message": f"Model '{model_name}' registered successfully!"}), 200
+    return jsonify(start_registration(model_name, upload_path, model_prompt)), 202
 
 
-def extract_frames(video_path, frame_interval = 30):
-    vidcap = cv2.VideoCapture(video_path)
-    frames = []
+def model_upload_path(model_name):
+    # The upload only replaces models/<name>_best.pt once the weights have been validated:
+    os.makedirs("models", exist_ok=True)
+    return os.path.join("models", f".{model_name}.{uuid.uuid4().hex}.pt")
 
-    success, image = vidcap.read()
-    count = 0
 
-    while success:
-        if count % frame_interval == 0:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            frames.append(image)
+def start_registration(model_name, upload_path, model_prompt):
+    """
+    Queues the registration of uploaded weights and returns the /add_model response.
+    """
+    save_path = os.path.join("models", f"{model_name}_best.pt")
+    job_id = uuid.uuid4().hex
+    registration_jobs[job_id] = {"model": model_name, "status": "pending"}
+    while len(registration_jobs) > 100:
+        registration_jobs.pop(next(iter(registration_jobs)))
+    registration_executor.submit(finish_registration, job_id, model_name, upload_path, save_path, model_prompt)
+
+    return {
+        "message": f"Model '{model_name}' is being registered.",
+        "jobId": job_id,
+        "statusUrl": f"/add_model/{job_id}"
+    }
+
+
+@app.route('/add_model/<job_id>', methods = ["GET"])
+def add_model_status(job_id):
+    if job_id not in registration_jobs:
+        return jsonify({"error": "Unknown registration job"}), 404
+    return jsonify(registration_jobs[job_id])
+
+
+def finish_registration(job_id, model_name, upload_path, save_path, model_prompt):
+    """
+    Background half of /add_model: validates and loads the uploaded weights and builds the new gating index,
+    then publishes them (file, config, registry and gating index of every process) and invalidates cached results.
+    Nothing is published until the model can be gated; if publishing fails, the previous weights,
+    config entries and registrations are restored.
+    """
+    registration_jobs[job_id] = {"model": model_name, "status": "loading"}
+
+    try:
+        model = models.load_weights(upload_path)
+        model_config = load_config()
+        model_config["models"][model_name] = save_path
+        model_config["text_prompts"][model_name] = model_prompt
+        new_index = prepare_model_index(model_name, model, model_config)
+    except Exception as error:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        registration_jobs[job_id] = {"model": model_name, "status": "failed", "error": str(error)}
+        return
+
+    previous_config = load_config()
+    backup_path = backup_weights(save_path)
+    try:
+        os.replace(upload_path, save_path)
+        update_config_yaml(model_name, model_prompt)
+        register_model(model_name, save_path, model, new_index)
+        if worker_pool is not None:
+            worker_pool.broadcast("register_model", model_name, save_path)
+        update_prompt_embeddings()
+    except Exception as error:
+        rollback_registration(model_name, upload_path, save_path, backup_path, previous_config)
+        registration_jobs[job_id] = {"model": model_name, "status": "failed", "error": str(error)}
+        return
+    finally:
+        if backup_path is not None and os.path.exists(backup_path):
+            os.remove(backup_path)
+        # Results computed with the previous registry are no longer valid:
+        invalidate_results()
+
+    registration_jobs[job_id] = {"model": model_name, "status": "ready"}
+
+
+def backup_weights(save_path):
+    """
+    Keeps the weights a registration replaces, as a hard link (or a copy) next to them.
+    Returns the backup path, or None for a new model.
+    """
+    if not os.path.exists(save_path):
+        return None
+    backup_path = os.path.join(os.path.dirname(save_path), f".{uuid.uuid4().hex}.previous.pt")
+    try:
+        os.link(save_path, backup_path)
+    except OSError:
+        shutil.copy2(save_path, backup_path)
+    return backup_path
+
+
+def rollback_registration(model_name, upload_path, save_path, backup_path, previous_config):
+    """
+    Undoes a partially published registration: puts the previous weights and config entries back
+    and re-registers the previous model (or removes the new one) in every process.
+    """
+    try:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        if backup_path is not None:
+            os.replace(backup_path, save_path)
+            task = ("register_model", model_name, save_path)
+        else:
+            if os.path.exists(save_path):
+                os.remove(save_path)
+            task = ("unregister_model", model_name)
+
+        restore_config_yaml(model_name, previous_config)
+        INFERENCE_TASKS[task[0]](*task[1:])
+        if worker_pool is not None:
+            worker_pool.broadcast(*task)
+    except Exception as error:
+        print(f"Could not roll back the registration of '{model_name}': {error}")
+
+
+def invalidate_results():
+    global model_version
+    model_version = build_model_version()
+    result_cache.invalidate()
+
+
+def update_prompt_embeddings():
+    """
+    Writes the current gating index as the next revision of the precomputed embedding file.
+    register_model has already encoded the new prompts, the others come from the previous revision.
+    """
+    text_features = prompt_index.text_matrix(clip_model, processor, prompt_cache)
+    try:
+        prompt_cache.precomputed = save_prompt_embeddings(
+            clip_config["embedding_index"], prompt_index, text_features, clip_model_id(clip_model)
+        )
+    except OSError as error:
+        print(f"Could not update {clip_config['embedding_index']}: {error}")
 
-        success, image = vidcap.read()
-        count += 1
-    
-    vidcap.release()
-    return frames
 
+# Registrations run one at a time off the request thread, their status is polled on /add_model/<job_id>:
+registration_executor = ThreadPoolExecutor(max_workers=1, initializer=use_threads)
+registration_jobs = {}
 
-def annotate_frame(frame, prompt_to_prob):
-    frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-    y_offset = 30
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 0.7
-    thickness = 2
-    colour = (0, 0, 0)
 
-    sorted_prompt_to_prob = dict(sorted(prompt_to_prob.items(), key=lambda item: -item[1]))
+# Forked last, so that the workers inherit every handler and the fully loaded models.
+# Registered models are loaded up front so that their weights are shared with the workers too,
+# which needs a registry that can keep all of them resident:
+if fork_workers:
+    models.preload()
+    worker_pool = WorkerPool(
+        INFERENCE_TASKS, config["worker_pool"]["processes"], config["worker_pool"]["threads"],
+        replayed=("register_model", "unregister_model")
+    )
+    set_process_threads(torch_threads)
 
-    for prompt, prob in sorted_prompt_to_prob.items():
-        text = f"{prompt} ({prob:.2f})"
-        cv2.putText(frame_bgr, text, (10, y_offset), font, font_scale, colour, thickness)
-        y_offset += 30
-    
-    return frame_bgr
 
 if __name__ == '__main__':
     socketio.run(app, debug=True)
@@ -165,7 +165,7 @@ export default function PredictMedia() {
             predictedMedia:
               data.mediaType === "image"
                 ? "data:image/jpeg;base64," + data.image
-                : "data:video/mp4;base64," + data.video,
+                : "http://localhost:5000" + data.videoUrl,
             mediaType: data.mediaType,
             ...(data.prediction && { predictions: data.prediction }) 
           }
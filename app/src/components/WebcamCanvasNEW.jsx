@@ -3,6 +3,29 @@ import io from "socket.io-client";
 
 const socket = io("http://127.0.0.1:5000");
 
+const MAX_FRAME_WIDTH = 640;
+
+// Detections arrive as columns: boxes [x1, y1, x2, y2], scores and label_ids indexing labels,
+// either as JSON arrays or packed (uint16 boxes and label ids, float32 scores).
+function unpackDetections(columns) {
+    const packed = columns.boxes instanceof ArrayBuffer;
+    const boxes = packed ? new Uint16Array(columns.boxes) : columns.boxes.flat();
+    const scores = packed ? new Float32Array(columns.scores) : columns.scores;
+    const labelIds = packed ? new Uint16Array(columns.label_ids) : columns.label_ids;
+
+    const detections = [];
+    for (let i = 0; i < columns.count; i++) {
+        const label = columns.labels[labelIds[i]];
+        detections.push({
+            label: label,
+            confidence: scores[i],
+            text: `${label}: ${scores[i].toFixed(2)}`,
+            box: Array.from(boxes.slice(4 * i, 4 * i + 4)),
+        });
+    }
+    return detections;
+}
+
 function TextPrompts({ promptsArray, setPromptsArray, promptsRef }) {
     const handlePromptChange = (i, prompt) => {
         const newPromptsArray = [...promptsArray];
@@ -102,29 +125,30 @@ export default function WebcamCanvas() {
 
                     if (!canvas || !video || !streamRef.current) return;
 
+                    // Frames are downscaled before encoding, boxes come back in source coordinates:
+                    const scale = Math.min(1, MAX_FRAME_WIDTH / video.videoWidth);
                     const tempCanvas = document.createElement("canvas");
-                    tempCanvas.width = video.videoWidth;
-                    tempCanvas.height = video.videoHeight;
+                    tempCanvas.width = Math.round(video.videoWidth * scale);
+                    tempCanvas.height = Math.round(video.videoHeight * scale);
                     const tempCtx = tempCanvas.getContext("2d");
                     tempCtx.drawImage(video, 0, 0, tempCanvas.width, tempCanvas.height);
 
                     tempCanvas.toBlob((blob) => {
                         if (!blob) return;
-                        const reader = new FileReader();
-                        reader.onloadend = () => {
-                            const base64Image = reader.result;
-
+                        blob.arrayBuffer().then((buffer) => {
                             const cleanedPrompts = promptsRef.current
                                 .map((p) => p.trim())
                                 .filter((p) => p !== "");
 
+                            // Raw JPEG bytes are sent as a binary attachment instead of a base64 data URL:
                             socket.emit("frame", {
-                                image: base64Image,
+                                image: buffer,
                                 prompts: cleanedPrompts,
+                                source_size: [video.videoWidth, video.videoHeight],
+                                packed: true,
                             });
-                        };
-                        reader.readAsDataURL(blob);
-                    }, "image/jpeg");
+                        });
+                    }, "image/jpeg", 0.8);
                 }, 600);
             })
             .catch((err) => {
@@ -161,7 +185,7 @@ export default function WebcamCanvas() {
             const ctx = canvas.getContext("2d");
             ctx.clearRect(0, 0, canvas.width, canvas.height);
             if (data.type === "yolo") {
-                data.data.forEach((item) => {
+                unpackDetections(data.data).forEach((item) => {
                     const [x1, y1, x2, y2] = item.box;
                     const label = item.text;
                     ctx.strokeStyle = "red";
@@ -0,0 +1,204 @@
+"""
+Asyncio serving mode for the inference core of app.py: the same HTTP endpoints and socket events,
+served by python-socketio's AsyncServer and Starlette under an ASGI server.
+Connections are coroutines on one event loop, so idle or slow clients hold no thread; inference runs
+on a bounded thread pool (and webcam frames on the frame scheduler's), and uploads are streamed to disk.
+
+Needs starlette, python-multipart and uvicorn (in requirements.txt):
+    python asgi_app.py    or    uvicorn asgi_app:asgi --host 127.0.0.1 --port 5000
+The Flask server (python app.py) remains available.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import safe_join
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+import app as core
+from inference_handler.frame_scheduler import FrameScheduler
+from inference_handler.metrics import metrics
+from inference_handler.torch_threads import use_threads
+import asyncio
+import functools
+import io
+import os
+import shutil
+import tempfile
+import socketio
+
+asgi_config = core.config["asgi"]
+
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+
+# Inference of the HTTP endpoints; the event loop itself only parses requests and awaits results:
+inference_executor = ThreadPoolExecutor(
+    max_workers=asgi_config["inference_threads"], thread_name_prefix="inference", initializer=use_threads
+)
+event_loop = None
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def run_blocking(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, functools.partial(function, *args))
+
+
+def timed(path):
+    """
+    Observes the end-to-end latency of an endpoint into inference_request_seconds, as app.py does per route rule.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            with metrics.timer("inference_request_seconds", path=path):
+                return await endpoint(request)
+        return wrapper
+    return decorator
+
+
+async def read_image(upload) -> FileStorage:
+    # Images are small, they are read whole and wrapped like a Flask upload for the shared handlers:
+    return FileStorage(stream=io.BytesIO(await upload.read()), filename=upload.filename)
+
+
+async def save_upload(upload, path):
+    """
+    Copies a (spooled) multipart upload to path in chunks, off the event loop.
+    """
+    with open(path, "wb") as file:
+        await run_in_threadpool(shutil.copyfileobj, upload.file, file, UPLOAD_CHUNK_SIZE)
+
+
+@timed("/predict")
+async def predict(request: Request):
+    form = await request.form()
+    if "image" not in form:
+        return JSONResponse({"error": "No image uploaded!"}, 400)
+
+    file = await read_image(form["image"])
+    payload = await run_blocking(core.predict_payload, file, core.parse_prompts(form.get("prompts")))
+    await sio.emit("prediction", payload)
+
+    return JSONResponse({"status": "frame received"})
+
+
+@timed("/predict_image")
+async def predict_image(request: Request):
+    form = await request.form()
+    if "image" not in form:
+        return JSONResponse({"error": "No image uploaded!"}, 400)
+
+    prompt_list = core.parse_prompts(form.get("prompts"))
+    if not prompt_list:
+        return JSONResponse({"error": "No Prompts Given!"})
+
+    file = await read_image(form["image"])
+    return JSONResponse(await run_blocking(core.predict_image_response, file, prompt_list))
+
+
+@timed("/predict_video")
+async def predict_video(request: Request):
+    # Multipart parts are spooled to disk while the body streams in, never held in memory whole:
+    form = await request.form()
+    if "video" not in form:
+        return JSONResponse({"Error": "Video not uploaded!"}, 400)
+
+    prompt_list = core.parse_prompts(form.get("prompts"))
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp:
+        video_path = temp.name
+    await save_upload(form["video"], video_path)
+    await form.close()
+
+    response, status = await run_blocking(core.annotate_uploaded_video, video_path, prompt_list)
+    return JSONResponse(response, status)
+
+
+async def get_video(request: Request):
+    path = safe_join(core.video_dir, request.path_params["video_name"])
+    if path is None or not os.path.isfile(path):
+        return JSONResponse({"error": "Video not found"}, 404)
+    # Served in chunks, with range requests:
+    return FileResponse(path, media_type="video/mp4")
+
+
+@timed("/add_model")
+async def add_model(request: Request):
+    form = await request.form()
+    model_file = form.get("model")
+    model_name = form.get("name")
+    model_prompt = form.getlist("prompt")
+
+    if not model_file or not model_name or not model_prompt:
+        return JSONResponse({"error": "Missing model file or model name or model prompt"}, 400)
+
+    upload_path = core.model_upload_path(model_name)
+    await save_upload(model_file, upload_path)
+    await form.close()
+
+    return JSONResponse(core.start_registration(model_name, upload_path, model_prompt), 202)
+
+
+async def add_model_status(request: Request):
+    job_id = request.path_params["job_id"]
+    if job_id not in core.registration_jobs:
+        return JSONResponse({"error": "Unknown registration job"}, 404)
+    return JSONResponse(core.registration_jobs[job_id])
+
+
+async def get_metrics(request: Request):
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def emit_prediction(sid, payload):
+    # Called on a frame scheduler thread, the emit itself runs on the event loop:
+    payload["dropped"] = frame_scheduler.dropped(sid)
+    asyncio.run_coroutine_threadsafe(sio.emit("prediction", payload, to=sid), event_loop)
+
+
+# Same latest-frame-only scheduling as the Flask server, emitting through the AsyncServer:
+frame_scheduler = FrameScheduler(core.process_frame, emit_prediction, core.config["scheduler"]["workers"])
+
+
+@sio.on("frame")
+async def handle_frame(sid, data):
+    if not data["image"]:
+        return {"error": "No image received!"}
+
+    dropped = frame_scheduler.submit(sid, data)
+    return {"status": "frame received", "dropped": dropped}
+
+
+@sio.on("disconnect")
+async def handle_disconnect(sid, *args):
+    frame_scheduler.remove(sid)
+    core.temporal_cache.drop(sid)
+
+
+async def on_startup():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+
+
+http_app = Starlette(
+    routes=[
+        Route("/predict", predict, methods=["POST"]),
+        Route("/predict_image", predict_image, methods=["POST"]),
+        Route("/predict_video", predict_video, methods=["POST"]),
+        Route("/videos/{video_name:path}", get_video, methods=["GET"]),
+        Route("/add_model", add_model, methods=["POST"]),
+        Route("/add_model/{job_id}", add_model_status, methods=["GET"]),
+        Route("/metrics", get_metrics, methods=["GET"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+)
+
+asgi = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=on_startup)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi, host=asgi_config["host"], port=asgi_config["port"])
@@ -0,0 +1,519 @@
+"""
+Reproducible benchmark for the CLIP gating + YOLO pipeline.
+
+Reports p50/p95/p99 latency per stage, gating throughput at several batch sizes and
+gating recall / extra-model rate, and writes everything to a JSON file so runs can be compared.
+
+    python benchmark.py --mode synthetic --output bench.json
+    python benchmark.py --mode dataset --batch-sizes 1 8 32
+    python benchmark.py --search-prompts 50000 --search-nprobe 1 4 16
+    python benchmark.py --video-seconds 20
+
+The synthetic mode runs offline on CPU: synthetic images, a tiny randomly initialized CLIP
+and randomly initialized YOLO models. Its accuracy numbers only exercise the pipeline.
+The dataset mode uses the configured CLIP checkpoint and YOLO models on the reference images
+and labels used by summary_statistics. --search-prompts additionally compares approximate (IVF)
+prompt search against exact search on a synthetic vocabulary of that many prompts.
+--video-seconds additionally times /predict_video on a synthetic video of static shots: keyframe sampling
+against the former fixed-interval sampling and against gating every frame.
+"""
+from contextlib import contextmanager
+from collections import defaultdict
+from io import BytesIO
+from typing import Dict, List, Tuple
+from PIL import Image
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import zlib
+import cv2
+import numpy as np
+import torch
+
+from inference_handler.output_handler import annotate_frame, draw_combined_predictions, extract_combined_predictions
+from inference_handler.prediction_handler import (
+    REFERENCE_IMAGE_DIR, REFERENCE_LABELS_PATH, ROAD_SCENE_LABELS, ROAD_SCENE_PROMPT,
+    return_top_prompts_batch, significant_prompts,
+)
+from inference_handler.preprocessing import ClipPreprocessor
+from inference_handler.prompt_cache import PromptEmbeddingCache, as_embeddings
+from inference_handler.prompt_index import PromptIndex
+from inference_handler.prompt_search import PromptSearchIndex
+from inference_handler.tiling import TileGrid
+from inference_handler.torch_threads import set_process_threads
+from inference_handler.video_handler import iter_sampled_frames, keyframe_gap, process_video
+import torch.nn.functional as F
+
+
+class StageTimer:
+    """
+    Collects wall-clock samples per pipeline stage.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for name, samples in self.samples.items():
+            samples_ms = np.asarray(samples) * 1000
+            summary[name] = {
+                "count": len(samples_ms),
+                "mean_ms": float(samples_ms.mean()),
+                "p50_ms": float(np.percentile(samples_ms, 50)),
+                "p95_ms": float(np.percentile(samples_ms, 95)),
+                "p99_ms": float(np.percentile(samples_ms, 99)),
+            }
+        return summary
+
+
+class SyntheticClipProcessor:
+    """
+    Minimal stand-in for CLIPProcessor so the benchmark needs no downloaded tokenizer:
+    words are hashed into a small vocabulary. Images are handled by wrapping it in a ClipPreprocessor,
+    which reads the standard CLIP normalization from image_processor.
+    """
+
+    class image_processor:
+        size = {"shortest_edge": 224}
+        crop_size = {"height": 224, "width": 224}
+        do_center_crop = True
+        rescale_factor = 1 / 255
+        image_mean = [0.48145466, 0.4578275, 0.40821073]
+        image_std = [0.26862954, 0.26130258, 0.27577711]
+
+    pad_token_id, bos_token_id, eos_token_id, vocab_size, max_length = 0, 1, 2, 1000, 32
+
+    def __call__(self, text, return_tensors="pt", padding=True, **kwargs):
+        token_ids = [
+            [self.bos_token_id]
+            + [3 + zlib.crc32(word.encode()) % (self.vocab_size - 3) for word in prompt.lower().split()][:self.max_length - 2]
+            + [self.eos_token_id]
+            for prompt in text
+        ]
+        length = max(len(ids) for ids in token_ids)
+        input_ids = torch.full((len(token_ids), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, ids in enumerate(token_ids):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def load_synthetic_clip() -> Tuple[torch.nn.Module, SyntheticClipProcessor]:
+    """
+    Usage: Build a tiny, randomly initialized CLIP model with the same interface as the TinyCLIP checkpoint.
+    """
+    from transformers import CLIPConfig, CLIPModel
+
+    processor = SyntheticClipProcessor()
+    config = CLIPConfig(
+        text_config=dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=2,
+                         vocab_size=processor.vocab_size, max_position_embeddings=processor.max_length,
+                         pad_token_id=processor.pad_token_id, bos_token_id=processor.bos_token_id,
+                         eos_token_id=processor.eos_token_id),
+        vision_config=dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=2,
+                           image_size=224, patch_size=32),
+        projection_dim=64,
+    )
+    return CLIPModel(config).eval(), processor
+
+
+def synthetic_images(count: int, size: Tuple[int, int], labels: List[str], rng: np.random.Generator):
+    """
+    Usage: Generate JPEG-encoded road-like images made of random shapes, each with 1-3 random ground-truth labels.
+    Outputs: List of (name, jpeg bytes, labels) tuples.
+    """
+    width, height = size
+    samples = []
+    for idx in range(count):
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        image[:height // 2] = rng.integers(100, 255, size=3)
+        image[height // 2:] = rng.integers(0, 120, size=3)
+        for _ in range(rng.integers(3, 12)):
+            x1, y1 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            x2, y2 = int(x1 + rng.integers(10, width // 4)), int(y1 + rng.integers(10, height // 4))
+            cv2.rectangle(image, (x1, y1), (x2, y2), tuple(int(c) for c in rng.integers(0, 255, size=3)), -1)
+
+        success, encoded = cv2.imencode(".jpg", image)
+        image_labels = list(rng.choice(labels, size=int(rng.integers(1, 4)), replace=False))
+        samples.append((f"synthetic_{idx}.jpg", encoded.tobytes(), image_labels))
+    return samples
+
+
+def dataset_images(limit: int):
+    """
+    Usage: Load the reference images and their labels as used by summary_statistics.
+    Outputs: List of (name, jpeg bytes, labels) tuples.
+    """
+    with open(REFERENCE_LABELS_PATH, 'r') as file:
+        labels = {image_dict["file"]: image_dict["labels"] for image_dict in json.load(file)}
+
+    samples = []
+    for filename in sorted(os.listdir(REFERENCE_IMAGE_DIR))[:limit]:
+        with open(os.path.join(REFERENCE_IMAGE_DIR, filename), 'rb') as file:
+            samples.append((filename, file.read(), labels.get(filename, [])))
+    return samples
+
+
+def run_benchmark(args) -> Dict:
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    set_process_threads(args.threads)
+
+    labels = ROAD_SCENE_LABELS
+    prompts = [ROAD_SCENE_PROMPT.format(label) for label in labels]
+    prompt_index = PromptIndex.from_text_prompts({label: [prompt] for label, prompt in zip(labels, prompts)})
+
+    from ultralytics import YOLO
+    if args.mode == "synthetic":
+        clip_model, clip_processor = load_synthetic_clip()
+        samples = synthetic_images(args.images, tuple(args.size), labels, rng)
+        yolo_models = {f"detector_{idx}": YOLO(args.yolo_config) for idx in range(args.yolo_models)}
+    else:
+        from inference_handler.model_loader import load_clip_model
+        from utils.config_loader import load_config
+        clip_model, clip_processor = load_clip_model()
+        samples = dataset_images(args.images)
+        yolo_models = {name: YOLO(path) for name, path in load_config()["models"].items()}
+
+    preprocessor = ClipPreprocessor(clip_processor, args.highlight_threshold, max(args.batch_sizes))
+    prompt_cache = PromptEmbeddingCache()
+    timer = StageTimer()
+    tiling = TileGrid(*args.tiles, args.tile_overlap, args.tile_aggregate) if args.tiles else None
+
+    # Warm up every model once so that lazy initialization does not end up in the percentiles:
+    warmup = Image.open(BytesIO(samples[0][1])).convert("RGB")
+    return_top_prompts_batch([warmup], prompts, clip_model, preprocessor, 1, prompt_cache, tiling)
+    for model in yolo_models.values():
+        model.predict(source=warmup, conf=args.confidence, verbose=False)
+
+    images = []
+    recalls, extra_counts, selected_counts = [], [], []
+
+    for name, jpeg_bytes, ground_truth in samples:
+        with timer.stage("decode"):
+            image = Image.open(BytesIO(jpeg_bytes)).convert("RGB")
+        images.append(image)
+
+        with timer.stage("preprocess"):
+            pixel_values = preprocessor.preprocess(tiling.views(image) if tiling else [image])
+
+        with timer.stage("clip_image"), torch.no_grad():
+            image_features = F.normalize(as_embeddings(clip_model.get_image_features(pixel_values=pixel_values)), p=2, dim=-1)
+
+        # Uncached text tower cost, i.e. what every frame paid before prompt embeddings were cached:
+        with timer.stage("clip_text"):
+            text_features = PromptEmbeddingCache().get_text_matrix(prompts, clip_model, preprocessor)
+
+        with timer.stage("gate"):
+            sims = image_features @ text_features.T
+            _, significant_mask = significant_prompts(tiling.aggregate(sims) if tiling else sims)
+            selected = prompt_index.classes_for(significant_mask[0])
+
+        predictions = {}
+        for model_name, model in yolo_models.items():
+            with timer.stage(f"yolo:{model_name}"):
+                results = model.predict(source=image, conf=args.confidence, verbose=False)
+            if results:
+                predictions[model_name] = results[0]
+
+        with timer.stage("annotate"):
+            annotated = draw_combined_predictions(predictions, image)
+
+        with timer.stage("encode"):
+            cv2.imencode(".jpg", annotated)
+            json.dumps(extract_combined_predictions(predictions).to_json())
+
+        if ground_truth:
+            recalls.append(len(set(selected) & set(ground_truth)) / len(ground_truth))
+        extra_counts.append(len(set(selected) - set(ground_truth)))
+        selected_counts.append(len(selected))
+
+    throughput = {}
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        return_top_prompts_batch(images, prompts, clip_model, preprocessor, batch_size, prompt_cache, tiling)
+        throughput[str(batch_size)] = len(images) / (time.perf_counter() - start)
+
+    return {
+        "environment": {
+            "mode": args.mode,
+            "images": len(samples),
+            "image_size": args.size if args.mode == "synthetic" else None,
+            "prompts": len(prompts),
+            "yolo_models": list(yolo_models),
+            "threads": args.threads,
+            "tiles": args.tiles,
+            "seed": args.seed,
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "stages": timer.summary(),
+        "gating_throughput_images_per_s": throughput,
+        "gating": {
+            "recall": float(np.mean(recalls)) if recalls else None,
+            "extra_models_mean": float(np.mean(extra_counts)),
+            "extra_model_rate": float(np.sum(extra_counts) / max(np.sum(selected_counts), 1)),
+            "selected_models_mean": float(np.mean(selected_counts)),
+        },
+    }
+
+
+def run_search_benchmark(args) -> Dict:
+    """
+    Exact vs IVF prompt search on a synthetic vocabulary: clustered unit vectors stand in for the text
+    features of many detectors' class prompts (one detector per cluster), and queries are noisy copies
+    of random prompts. Reports the latency per query batch, recall@k of the top-k prompts, and the recall
+    of the significant prompts and the share of queries selecting the same detectors as the exact gating
+    rule over the whole vocabulary, for every nprobe and for all lists probed ("all", which only loses
+    what the top_k cap drops).
+    """
+    generator = torch.Generator().manual_seed(args.seed)
+    dim, clusters = args.search_dim, max(1, args.search_prompts // 200)
+
+    centers = F.normalize(torch.randn(clusters, dim, generator=generator), dim=-1)
+    members = torch.randint(clusters, (args.search_prompts,), generator=generator)
+    text_features = F.normalize(centers[members] + 0.6 * torch.randn(args.search_prompts, dim, generator=generator) / dim ** 0.5, dim=-1)
+
+    sources = torch.randint(args.search_prompts, (args.search_queries,), generator=generator)
+    queries = F.normalize(text_features[sources] + 1.5 * torch.randn(args.search_queries, dim, generator=generator) / dim ** 0.5, dim=-1)
+
+    def timed(function, repeats=5):
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = function()
+            samples.append(time.perf_counter() - start)
+        return result, float(np.median(samples)) * 1000
+
+    exact = PromptSearchIndex(text_features, args.search_top_k, exact_threshold=args.search_prompts)
+    (_, exact_ids), exact_ms = timed(lambda: exact.search(queries, args.search_top_k))
+
+    start = time.perf_counter()
+    ivf = PromptSearchIndex(text_features, args.search_top_k, exact_threshold=0, seed=args.seed)
+    build_s = time.perf_counter() - start
+
+    # The reference is the gating rule over every prompt, which the top_k cap of the index does not bound:
+    _, exact_mask = significant_prompts(queries @ text_features.T)
+    exact_models = [set(members[row].tolist()) for row in exact_mask]
+
+    results = {}
+    for nprobe in args.search_nprobe + [ivf.nlist]:
+        ivf.nprobe = nprobe
+        (sims, ids), ivf_ms = timed(lambda: ivf.search(queries, args.search_top_k))
+        recall = np.mean([
+            len(set(row.tolist()) & set(exact_row.tolist())) / len(exact_row) for row, exact_row in zip(ids, exact_ids)
+        ])
+        _, mask = ivf.significant_prompts(queries)
+        significant_recall = (mask & exact_mask).sum().item() / max(exact_mask.sum().item(), 1)
+        model_agreement = np.mean([set(members[row].tolist()) == models for row, models in zip(mask, exact_models)])
+        results["all" if nprobe == ivf.nlist else str(nprobe)] = {
+            "latency_ms": ivf_ms, "recall_at_k": float(recall),
+            "significant_recall": significant_recall, "model_agreement": float(model_agreement),
+        }
+
+    return {
+        "prompts": args.search_prompts,
+        "dim": dim,
+        "queries": args.search_queries,
+        "top_k": args.search_top_k,
+        "nlist": ivf.nlist,
+        "build_s": build_s,
+        "exact_latency_ms": exact_ms,
+        "exact_significant_mean": exact_mask.sum(dim=-1).float().mean().item(),
+        "nprobe": results,
+    }
+
+
+def synthetic_video(path: str, seconds: float, shot_seconds: float, size: Tuple[int, int], fps: float,
+                    rng: np.random.Generator):
+    """
+    Usage: Write a synthetic video of static shots (synthetic_images scenes with per-frame sensor noise)
+    separated by hard cuts.
+    """
+    shot_frames = max(1, int(round(shot_seconds * fps)))
+    frame_count = int(round(seconds * fps))
+    shots = [cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+             for _, jpeg_bytes, _ in synthetic_images(-(-frame_count // shot_frames), size, ROAD_SCENE_LABELS, rng)]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    try:
+        for idx in range(frame_count):
+            noise = rng.integers(-3, 4, size=shots[0].shape, dtype=np.int16)
+            writer.write(np.clip(shots[idx // shot_frames] + noise, 0, 255).astype(np.uint8))
+    finally:
+        writer.release()
+
+
+def fixed_interval_video(video_path, output_path, prompt_list, clip_model, clip_processor,
+                         frame_interval=30, batch_size=16, fps=10) -> int:
+    """
+    Usage: The sampling /predict_video used before keyframes, as the baseline: every frame_interval-th frame
+    is decoded, gated, annotated and written at a fixed fps; the frames in between are only grabbed.
+    Outputs: Number of frames written.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    frames, frame_count, writer = [], 0, None
+
+    def flush():
+        nonlocal frame_count, writer
+        for frame, prompt_to_prob in zip(frames, return_top_prompts_batch(frames, prompt_list, clip_model, clip_processor, batch_size)):
+            annotated_frame = annotate_frame(frame, prompt_to_prob)
+            if writer is None:
+                height, width, _ = annotated_frame.shape
+                writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            writer.write(annotated_frame)
+            frame_count += 1
+        frames.clear()
+
+    try:
+        count = 0
+        while True:
+            if count % frame_interval == 0:
+                success, image = vidcap.read()
+                if not success:
+                    break
+                frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                if len(frames) == batch_size:
+                    flush()
+            elif not vidcap.grab():
+                break
+            count += 1
+        flush()
+    finally:
+        vidcap.release()
+        if writer is not None:
+            writer.release()
+    return frame_count
+
+
+def run_video_benchmark(args) -> Dict:
+    """
+    /predict_video on a synthetic video of static shots, with three samplings:
+    fixed_interval (the former pipeline: every 30th frame gated and written at 10 fps), every_frame
+    (every frame gated and written at the source frame rate) and keyframes (the current pipeline,
+    same output as every_frame). Reports the wall time, the frames gated and the frames written of each.
+    """
+    rng = np.random.default_rng(args.seed)
+    if args.mode == "synthetic":
+        clip_model, clip_processor = load_synthetic_clip()
+    else:
+        from inference_handler.model_loader import load_clip_model
+        clip_model, clip_processor = load_clip_model()
+    preprocessor = ClipPreprocessor(clip_processor, args.highlight_threshold, args.video_batch_size)
+    prompts = [ROAD_SCENE_PROMPT.format(label) for label in ROAD_SCENE_LABELS]
+    fps = 30.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = os.path.join(directory, "input.mp4")
+        output_path = os.path.join(directory, "output.mp4")
+        synthetic_video(video_path, args.video_seconds, args.video_shot_seconds, tuple(args.size), fps, rng)
+
+        # Every sampling starts with a warm prompt cache and model:
+        return_top_prompts_batch([np.zeros((64, 64, 3), np.uint8)], prompts, clip_model, preprocessor, 1)
+
+        def timed(function):
+            start = time.perf_counter()
+            written = function()
+            return time.perf_counter() - start, written
+
+        max_gap = keyframe_gap(args.video_max_gap_seconds, fps)
+        keyframes = sum(keyframe for _, keyframe in iter_sampled_frames(video_path, args.video_change_threshold, max_gap))
+        frame_count = int(round(args.video_seconds * fps))
+
+        runs = {
+            "fixed_interval": (lambda: fixed_interval_video(video_path, output_path, prompts, clip_model, preprocessor,
+                                                            30, args.video_batch_size), -(-frame_count // 30)),
+            "every_frame": (lambda: process_video(video_path, output_path, prompts, clip_model, preprocessor, -1.0,
+                                                  args.video_max_gap_seconds, args.video_batch_size), frame_count),
+            "keyframes": (lambda: process_video(video_path, output_path, prompts, clip_model, preprocessor,
+                                                args.video_change_threshold, args.video_max_gap_seconds,
+                                                args.video_batch_size), keyframes),
+        }
+        results = {}
+        for name, (function, gated) in runs.items():
+            seconds, written = timed(function)
+            results[name] = {"wall_s": seconds, "frames_gated": int(gated), "frames_written": written}
+
+    return {
+        "seconds": args.video_seconds,
+        "shot_seconds": args.video_shot_seconds,
+        "fps": fps,
+        "size": args.size,
+        "change_threshold": args.video_change_threshold,
+        "max_gap_seconds": args.video_max_gap_seconds,
+        "samplings": results,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the CLIP gating + YOLO pipeline.")
+    parser.add_argument("--mode", choices=["synthetic", "dataset"], default="synthetic")
+    parser.add_argument("--images", type=int, default=64, help="Number of images (synthetic) or maximum images read (dataset).")
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--yolo-models", type=int, default=2, help="Number of random YOLO models in synthetic mode.")
+    parser.add_argument("--yolo-config", default="yolov8n.yaml", help="Ultralytics model yaml for the random YOLO models.")
+    parser.add_argument("--confidence", type=float, default=0.3)
+    parser.add_argument("--highlight-threshold", type=int, default=194)
+    parser.add_argument("--tiles", type=int, nargs=2, metavar=("ROWS", "COLS"), help="Gate on a grid of crops plus the global view.")
+    parser.add_argument("--tile-overlap", type=float, default=0.25)
+    parser.add_argument("--tile-aggregate", choices=["max", "softmax"], default="max")
+    parser.add_argument("--search-prompts", type=int, help="Also benchmark IVF prompt search on this many synthetic prompts.")
+    parser.add_argument("--search-nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--search-top-k", type=int, default=64)
+    parser.add_argument("--search-queries", type=int, default=16)
+    parser.add_argument("--search-dim", type=int, default=512)
+    parser.add_argument("--video-seconds", type=float, help="Also benchmark /predict_video on a synthetic video this long.")
+    parser.add_argument("--video-shot-seconds", type=float, default=4.0, help="Length of each static shot of the synthetic video.")
+    parser.add_argument("--video-change-threshold", type=float, default=0.04)
+    parser.add_argument("--video-max-gap-seconds", type=float, default=2.0)
+    parser.add_argument("--video-batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args)
+    if args.search_prompts:
+        report["prompt_search"] = run_search_benchmark(args)
+    if args.video_seconds:
+        report["video"] = run_video_benchmark(args)
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<20} p50 {stats['p50_ms']:8.2f} ms   p95 {stats['p95_ms']:8.2f} ms   p99 {stats['p99_ms']:8.2f} ms")
+    for batch_size, images_per_s in report["gating_throughput_images_per_s"].items():
+        print(f"gating batch {batch_size:<7} {images_per_s:8.1f} images/s")
+    print(f"gating {report['gating']}")
+    if "prompt_search" in report:
+        search = report["prompt_search"]
+        print(f"prompt search over {search['prompts']} prompts: exact {search['exact_latency_ms']:.2f} ms, IVF build {search['build_s']:.1f} s, "
+              f"{search['exact_significant_mean']:.1f} significant prompts per query")
+        for nprobe, stats in search["nprobe"].items():
+            print(f"  nprobe {nprobe:<5} {stats['latency_ms']:8.2f} ms   recall@{search['top_k']} {stats['recall_at_k']:.3f}   "
+                  f"significant {stats['significant_recall']:.3f}   same models {stats['model_agreement']:.3f}")
+    if "video" in report:
+        video = report["video"]
+        print(f"video of {video['seconds']:.0f} s in {video['shot_seconds']:.0f} s shots at {video['fps']:.0f} fps:")
+        for sampling, stats in video["samplings"].items():
+            print(f"  {sampling:<15} {stats['wall_s']:8.2f} s   gated {stats['frames_gated']:5d}   written {stats['frames_written']:5d}")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,138 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+import os
+import queue
+import threading
+import time
+import numpy as np
+from inference_handler.metrics import metrics
+from inference_handler.model_loader import predict_lock
+from inference_handler.torch_threads import use_threads
+
+
+class MicroBatcher:
+    """
+    Dynamic batching of concurrent requests (as in Triton's dynamic batcher): requests submitted from any
+    thread are queued, and a single batching thread takes the oldest one, waits at most max_wait_ms for more
+    to arrive (up to max_batch_size), runs run_batch once on the whole list and resolves every request with
+    its own result. Under load the batches fill up without waiting; a lone request waits at most max_wait_ms.
+    The thread is started on first use, and again in a forked worker process.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 5, name: str = "batch"):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, item: Any) -> Future:
+        """
+        Usage: Queue one request for the next batch.
+        Outputs: A Future of the request's entry in the run_batch result.
+        """
+        future = Future()
+        self._ensure_started().put((item, future))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def _ensure_started(self) -> "queue.Queue":
+        with self._lock:
+            # Threads do not survive a fork, a worker process starts its own:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                threading.Thread(target=self._loop, args=(self._queue,), name=self.name, daemon=True).start()
+            return self._queue
+
+    def _loop(self, pending: "queue.Queue"):
+        use_threads()
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(pending.get(timeout=timeout) if timeout > 0 else pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            metrics.observe("inference_batch_size", len(batch), batcher=self.name)
+            self.batches += 1
+            self.items += len(batch)
+
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.run_batch(items))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name} returned {len(results)} results for a batch of {len(batch)}")
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class YoloBatchers:
+    """
+    One MicroBatcher per YOLO model: the frames of all clients that selected a model within max_wait_ms
+    go through a single predict call on the list of frames.
+    """
+
+    def __init__(self, models, max_batch_size: int = 8, max_wait_ms: float = 5):
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batchers: Dict[str, MicroBatcher] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MicroBatcher:
+        with self._lock:
+            if name not in self._batchers:
+                self._batchers[name] = MicroBatcher(
+                    lambda items: predict_yolo_batch(self.models[name], items),
+                    self.max_batch_size, self.max_wait_ms, name=f"yolo:{name}"
+                )
+            return self._batchers[name]
+
+    def predict(self, name: str, image, confidence: float, classes=None):
+        """
+        Usage: Detect on one BGR image with the named model, batched with concurrent requests for it.
+        Outputs: The ultralytics Results of the image.
+        """
+        return self[name]((image, confidence, classes))
+
+
+def predict_yolo_batch(model, items: List[tuple]) -> list:
+    """
+    Usage: Runs one YOLO model over the (BGR image, confidence, class ids) requests of a batch.
+    Requests with the same confidence share one predict call over all their images, restricted to
+    the union of their classes; each result is then reduced to the classes its request asked for
+    (NMS is per class, so the boxes match a separate run).
+    Outputs: List of ultralytics Results, one per request.
+    """
+    results = [None] * len(items)
+    for confidence in dict.fromkeys(confidence for _, confidence, _ in items):
+        indices = [index for index, (_, item_confidence, _) in enumerate(items) if item_confidence == confidence]
+        requested = [items[index][2] for index in indices]
+        classes = None if any(item_classes is None for item_classes in requested) \
+            else sorted({class_id for item_classes in requested for class_id in item_classes})
+
+        with predict_lock(model):
+            predictions = model.predict(
+                source=[items[index][0] for index in indices], conf=confidence, classes=classes, verbose=False
+            )
+        for index, item_classes, result in zip(indices, requested, predictions):
+            if item_classes is not None and (classes is None or len(item_classes) < len(classes)):
+                result = result[np.isin(result.boxes.cls.cpu().numpy().astype(int), item_classes)]
+            results[index] = result
+    return results
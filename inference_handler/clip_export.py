@@ -0,0 +1,275 @@
+"""
+Export of the CLIP gate to standalone vision / text encoder graphs for CPU inference.
+
+    python -m inference_handler.clip_export --format onnx --output-dir models/clip_export
+    python -m inference_handler.clip_export --format torchscript --quantize
+
+The exported graphs are checked against the eager HuggingFace model on export and again when the
+server loads them (clip.backend in utils/config.yaml), so the gating scores stay equivalent: an export whose
+gating probabilities differ by more than the tolerance (clip.export_tolerance) is not written.
+"""
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import torch
+import torch.nn.functional as F
+from inference_handler.prompt_cache import as_embeddings, clip_model_id
+from inference_handler.prediction_handler import ROAD_SCENE_LABELS, ROAD_SCENE_PROMPT, significant_prompts
+from inference_handler.preprocessing import get_preprocessor
+
+MANIFEST_NAME = "manifest.json"
+BACKENDS = ("torchscript", "onnx")
+
+
+class _VisionEncoder(torch.nn.Module):
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, pixel_values):
+        return as_embeddings(self.clip_model.get_image_features(pixel_values=pixel_values))
+
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, input_ids, attention_mask):
+        return as_embeddings(self.clip_model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+
+class ExportedClipModel:
+    """
+    Drop-in replacement for CLIPModel in the gating path, backed by exported encoder graphs.
+    Only get_image_features and get_text_features are provided; both return the projected features.
+    """
+
+    def __init__(self, vision_encoder, text_encoder, backend: str, name_or_path: str):
+        self.vision_encoder = vision_encoder
+        self.text_encoder = text_encoder
+        self.backend = backend
+        self.name_or_path = name_or_path
+
+    def eval(self):
+        return self
+
+    def get_image_features(self, pixel_values, **kwargs) -> torch.Tensor:
+        if self.backend == "onnx":
+            outputs = self.vision_encoder.run(None, {"pixel_values": pixel_values.numpy()})
+            return torch.from_numpy(outputs[0])
+        with torch.no_grad():
+            return self.vision_encoder(pixel_values)
+
+    def get_text_features(self, input_ids, attention_mask=None, **kwargs) -> torch.Tensor:
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if self.backend == "onnx":
+            outputs = self.text_encoder.run(None, {
+                "input_ids": input_ids.numpy().astype(np.int64),
+                "attention_mask": attention_mask.numpy().astype(np.int64),
+            })
+            return torch.from_numpy(outputs[0])
+        with torch.no_grad():
+            return self.text_encoder(input_ids, attention_mask)
+
+
+def _example_inputs(clip_processor, batch_size: int = 2):
+    preprocessor = get_preprocessor(clip_processor)
+    pixel_values = torch.randn(batch_size, 3, *preprocessor.crop_size)
+    prompts = [ROAD_SCENE_PROMPT.format(label) for label in ROAD_SCENE_LABELS[:batch_size]]
+    text_inputs = clip_processor(text=prompts, return_tensors="pt", padding=True)
+    return pixel_values, text_inputs["input_ids"], text_inputs["attention_mask"]
+
+
+def export_clip(clip_model, clip_processor, output_dir: str, fmt: str = "onnx", quantize: bool = False,
+                opset: int = 17, tolerance: float = 0.05) -> Dict:
+    """
+    Usage: Export the CLIP vision and text encoders as separate graphs, optionally with dynamic int8
+    quantization of the linear layers, and check them against the eager model. The graphs are exported
+    to a staging directory and only moved to output_dir if their gating probabilities are within tolerance,
+    so a failed export leaves a previous one in place.
+    Inputs: The eager CLIP model and processor, the output directory, "onnx" or "torchscript", quantize flag,
+    the ONNX opset, the largest gating probability difference allowed
+    Outputs: The manifest written next to the graphs, including the equivalence check.
+    Raises ValueError if the check exceeds the tolerance.
+    """
+    if fmt not in BACKENDS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {BACKENDS}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=output_dir, prefix=".export-")
+    try:
+        manifest = _export_graphs(clip_model, clip_processor, staging_dir, fmt, quantize, opset)
+        manifest["check"] = check_equivalence(load_exported_clip(staging_dir), clip_model, clip_processor)
+        if manifest["check"]["max_prob_diff"] > tolerance:
+            raise ValueError(
+                f"Exported CLIP scores differ from the eager model by {manifest['check']['max_prob_diff']:.4f} "
+                f"(tolerance {tolerance}), the export was not written: {manifest['check']}"
+            )
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as file:
+            json.dump(manifest, file, indent=2)
+
+        # The manifest goes last, so the server never reads a manifest whose graphs are not in place:
+        for name in (manifest["vision_encoder"], manifest["text_encoder"], MANIFEST_NAME):
+            os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return manifest
+
+
+def _export_graphs(clip_model, clip_processor, output_dir: str, fmt: str, quantize: bool, opset: int) -> Dict:
+    clip_model = clip_model.eval()
+    pixel_values, input_ids, attention_mask = _example_inputs(clip_processor)
+
+    vision_encoder, text_encoder = _VisionEncoder(clip_model).eval(), _TextEncoder(clip_model).eval()
+    suffix = ".onnx" if fmt == "onnx" else ".pt"
+    vision_path = os.path.join(output_dir, f"vision_encoder{suffix}")
+    text_path = os.path.join(output_dir, f"text_encoder{suffix}")
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            if quantize:
+                vision_encoder = torch.ao.quantization.quantize_dynamic(vision_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+                text_encoder = torch.ao.quantization.quantize_dynamic(text_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+            torch.jit.save(torch.jit.freeze(torch.jit.trace(vision_encoder, (pixel_values,))), vision_path)
+            torch.jit.save(torch.jit.freeze(torch.jit.trace(text_encoder, (input_ids, attention_mask))), text_path)
+        else:
+            torch.onnx.export(
+                vision_encoder, (pixel_values,), vision_path, input_names=["pixel_values"],
+                output_names=["image_features"], dynamic_axes={"pixel_values": {0: "batch"}, "image_features": {0: "batch"}},
+                opset_version=opset, dynamo=False,
+            )
+            torch.onnx.export(
+                text_encoder, (input_ids, attention_mask), text_path, input_names=["input_ids", "attention_mask"],
+                output_names=["text_features"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                              "text_features": {0: "batch"}},
+                opset_version=opset, dynamo=False,
+            )
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                for path in (vision_path, text_path):
+                    quantize_dynamic(path, path, weight_type=QuantType.QInt8)
+
+    manifest = {
+        "format": fmt,
+        "quantized": quantize,
+        "source": clip_model_id(clip_model),
+        "vision_encoder": os.path.basename(vision_path),
+        "text_encoder": os.path.basename(text_path),
+    }
+    # load_exported_clip reads the graphs through the manifest, export_clip rewrites it with the check:
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_exported_clip(export_dir: str, num_threads: Optional[int] = None) -> ExportedClipModel:
+    """
+    Usage: Load the encoder graphs written by export_clip.
+    Inputs: The export directory, optionally the number of intra-op threads for ONNX Runtime
+    Outputs: An ExportedClipModel.
+    """
+    with open(os.path.join(export_dir, MANIFEST_NAME), "r") as file:
+        manifest = json.load(file)
+
+    vision_path = os.path.join(export_dir, manifest["vision_encoder"])
+    text_path = os.path.join(export_dir, manifest["text_encoder"])
+
+    if manifest["format"] == "onnx":
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        vision_encoder = ort.InferenceSession(vision_path, options, providers=["CPUExecutionProvider"])
+        text_encoder = ort.InferenceSession(text_path, options, providers=["CPUExecutionProvider"])
+    else:
+        vision_encoder = torch.jit.load(vision_path).eval()
+        text_encoder = torch.jit.load(text_path).eval()
+
+    variant = f"{manifest['format']}-int8" if manifest["quantized"] else manifest["format"]
+    return ExportedClipModel(vision_encoder, text_encoder, manifest["format"], f"{manifest['source']}:{variant}")
+
+
+def check_equivalence(exported_model, reference_model, clip_processor, num_images: int = 4,
+                      prompts: Optional[List[str]] = None) -> Dict:
+    """
+    Usage: Compare the gating scores of an exported model against the eager model on random inputs.
+    Inputs: The exported model, the eager CLIP model and processor, number of images, optional prompts
+    Outputs: Dictionary with the largest probability difference, the largest embedding cosine distance
+    and the fraction of gating decisions that agree.
+    """
+    preprocessor = get_preprocessor(clip_processor)
+    generator = torch.Generator().manual_seed(0)
+    pixel_values = torch.randn(num_images, 3, *preprocessor.crop_size, generator=generator)
+
+    if prompts is None:
+        prompts = [ROAD_SCENE_PROMPT.format(label) for label in ROAD_SCENE_LABELS]
+    text_inputs = clip_processor(text=prompts, return_tensors="pt", padding=True)
+
+    features = []
+    with torch.no_grad():
+        for model in (reference_model, exported_model):
+            image_features = F.normalize(as_embeddings(model.get_image_features(pixel_values=pixel_values)), p=2, dim=-1)
+            text_features = F.normalize(as_embeddings(model.get_text_features(**text_inputs)), p=2, dim=-1)
+            features.append((image_features, text_features))
+
+    (reference_image, reference_text), (exported_image, exported_text) = features
+    reference_probs, reference_mask = significant_prompts(reference_image @ reference_text.T)
+    exported_probs, exported_mask = significant_prompts(exported_image @ exported_text.T)
+
+    return {
+        "max_prob_diff": float((reference_probs - exported_probs).abs().max()),
+        "max_embedding_distance": float(max(
+            (1 - (reference_image * exported_image).sum(-1)).max(),
+            (1 - (reference_text * exported_text).sum(-1)).max(),
+        )),
+        "decision_agreement": float((reference_mask == exported_mask).float().mean()),
+    }
+
+
+def load_clip_backend(clip_model, clip_processor, backend: str = "eager", export_dir: str = "models/clip_export",
+                      tolerance: float = 0.01, num_threads: Optional[int] = None):
+    """
+    Usage: Returns the model to run the CLIP gate on: the eager model, or the exported graphs after checking
+    that their gating probabilities are within tolerance of the eager model.
+    Inputs: The eager CLIP model and processor, "eager" / "torchscript" / "onnx", the export directory, the tolerance
+    Outputs: The CLIP model (eager or ExportedClipModel).
+    """
+    if backend == "eager":
+        return clip_model
+
+    exported_model = load_exported_clip(export_dir, num_threads)
+    if exported_model.backend != backend:
+        raise ValueError(f"Export in '{export_dir}' is '{exported_model.backend}', but clip.backend is '{backend}'")
+
+    check = check_equivalence(exported_model, clip_model, clip_processor)
+    print(f"CLIP {exported_model.name_or_path} check: {check}")
+    if check["max_prob_diff"] > tolerance:
+        raise ValueError(f"Exported CLIP scores differ from the eager model by {check['max_prob_diff']:.4f} (tolerance {tolerance})")
+    return exported_model
+
+
+if __name__ == "__main__":
+    from inference_handler.model_loader import load_clip_model
+    from utils.config_loader import load_config
+
+    parser = argparse.ArgumentParser(description="Export the CLIP gate to ONNX or TorchScript encoder graphs.")
+    parser.add_argument("--format", choices=BACKENDS, default="onnx")
+    parser.add_argument("--quantize", action="store_true", help="Apply dynamic int8 quantization to the linear layers.")
+    parser.add_argument("--output-dir", default="models/clip_export")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="Largest gating probability difference allowed (default: clip.export_tolerance in utils/config.yaml).")
+    args = parser.parse_args()
+    tolerance = args.tolerance if args.tolerance is not None else load_config()["clip"]["export_tolerance"]
+
+    clip_model, clip_processor = load_clip_model()
+    manifest = export_clip(clip_model, clip_processor, args.output_dir, args.format, args.quantize, args.opset, tolerance)
+    print(json.dumps(manifest, indent=2))
@@ -0,0 +1,190 @@
+"""
+Precomputed text embeddings of the gating prompts, stored next to utils/config.yaml.
+
+    python -m inference_handler.embedding_index
+
+encodes every registered prompt (config["text_prompts"] and the label prompts of config["label_prompts"])
+with the configured CLIP checkpoint and writes a float16 matrix (prompt_embeddings.r<revision>.npy) plus
+a manifest holding the format version, the checkpoint and the prompt / model / class id of every row.
+The server memory-maps the matrix on startup, so the text tower does not run for registered prompts
+and the pages are shared between worker processes. Prompts already in the file are never re-encoded,
+and /add_model writes a new revision with the prompts of the added model.
+"""
+from typing import Dict, List, Optional
+import argparse
+import glob
+import json
+import os
+import stat
+import tempfile
+import numpy as np
+import torch
+from inference_handler.prompt_cache import PromptEmbeddingCache, clip_model_id, normalize_prompt
+
+EMBEDDING_FORMAT = 1
+DEFAULT_MANIFEST_PATH = "utils/prompt_embeddings.json"
+
+
+class PromptEmbeddingStore:
+    """
+    Read-only view of a precomputed embedding file: a memory-mapped float16 matrix [num_prompts, hidden_dim]
+    whose rows are L2-normalized text embeddings, looked up by normalized prompt.
+    """
+
+    def __init__(self, manifest: Dict, matrix: np.ndarray):
+        self.revision = manifest["revision"]
+        self.clip_model = manifest["clip_model"]
+        self.prompts: List[str] = manifest["prompts"]
+        self.model_names: List[str] = manifest["models"]
+        self.class_ids: List[int] = manifest["class_ids"]
+        self.matrix = matrix
+        self._rows = {}
+        for row, prompt in enumerate(self.prompts):
+            self._rows.setdefault(normalize_prompt(prompt), row)
+
+    def __len__(self) -> int:
+        return len(self.prompts)
+
+    @classmethod
+    def load(cls, manifest_path: str) -> Optional["PromptEmbeddingStore"]:
+        """
+        Usage: Memory-maps the embedding file described by the manifest.
+        Outputs: The store, or None when there is no file or it was written in another format.
+        """
+        try:
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        if manifest.get("format") != EMBEDDING_FORMAT:
+            print(f"Ignoring {manifest_path}: embedding format {manifest.get('format')}, expected {EMBEDDING_FORMAT}")
+            return None
+
+        matrix_path = os.path.join(os.path.dirname(manifest_path), manifest["matrix"])
+        matrix = np.load(matrix_path, mmap_mode="r")
+        if matrix.shape[0] != len(manifest["prompts"]):
+            print(f"Ignoring {manifest_path}: {matrix.shape[0]} rows for {len(manifest['prompts'])} prompts")
+            return None
+        return cls(manifest, matrix)
+
+    def get(self, model_id: str, prompt: str) -> Optional[torch.Tensor]:
+        """
+        Usage: The precomputed embedding of a prompt, if it was encoded with the CLIP checkpoint model_id.
+        Outputs: Float32 tensor [hidden_dim] or None.
+        """
+        if model_id != self.clip_model:
+            return None
+        row = self._rows.get(normalize_prompt(prompt))
+        if row is None:
+            return None
+        return torch.from_numpy(self.matrix[row].astype(np.float32))
+
+    def text_matrix(self) -> torch.Tensor:
+        """
+        Usage: All rows as one float32 tensor [num_prompts, hidden_dim], converted from the mapped matrix at once.
+        """
+        return torch.from_numpy(self.matrix.astype(np.float32))
+
+    def matches(self, prompt_index, model_id: str) -> bool:
+        """
+        Usage: Whether the file holds exactly the rows of the prompt index, encoded with model_id.
+        """
+        return (
+            model_id == self.clip_model and self.prompts == prompt_index.prompts
+            and self.model_names == [prompt_index.model_names[idx] for idx in prompt_index.prompt_model_ids.tolist()]
+            and self.class_ids == prompt_index.prompt_class_ids.tolist()
+        )
+
+
+def save_prompt_embeddings(manifest_path: str, prompt_index, text_features: torch.Tensor, model_id: str) -> PromptEmbeddingStore:
+    """
+    Usage: Writes the text features of a prompt index as the next revision of the embedding file.
+    The matrix is written under a new name and the manifest is replaced atomically after it, so readers
+    see either the old or the new revision; processes that still map an older matrix keep it until they exit.
+    Inputs: The manifest path, a PromptIndex, its normalized text features [num_prompts, hidden_dim], the CLIP checkpoint id
+    Outputs: The new store.
+    """
+    directory = os.path.dirname(manifest_path) or "."
+    previous = PromptEmbeddingStore.load(manifest_path) if os.path.exists(manifest_path) else None
+    revision = previous.revision + 1 if previous is not None else 1
+
+    stem = os.path.splitext(os.path.basename(manifest_path))[0]
+    matrix_name = f"{stem}.r{revision}.npy"
+    manifest = {
+        "format": EMBEDDING_FORMAT,
+        "revision": revision,
+        "clip_model": model_id,
+        "dim": int(text_features.shape[-1]),
+        "dtype": "float16",
+        "matrix": matrix_name,
+        "prompts": list(prompt_index.prompts),
+        "models": [prompt_index.model_names[idx] for idx in prompt_index.prompt_model_ids.tolist()],
+        "class_ids": prompt_index.prompt_class_ids.tolist(),
+    }
+
+    # The files keep the permissions of the previous manifest, or get those of the directory (without execute):
+    mode = stat.S_IMODE(os.stat(manifest_path if previous is not None else directory).st_mode) & 0o666
+    _atomic_write(directory, os.path.join(directory, matrix_name),
+                  lambda file: np.save(file, text_features.detach().cpu().numpy().astype(np.float16)), "wb", mode)
+    _atomic_write(directory, manifest_path, lambda file: json.dump(manifest, file, indent=2), "w", mode)
+
+    for path in glob.glob(os.path.join(directory, f"{stem}.r*.npy")):
+        if os.path.basename(path) != matrix_name:
+            os.remove(path)
+    return PromptEmbeddingStore.load(manifest_path)
+
+
+def build_prompt_embeddings(manifest_path: str, prompt_index, clip_model, clip_processor,
+                            prompt_cache: Optional[PromptEmbeddingCache] = None) -> PromptEmbeddingStore:
+    """
+    Usage: Brings the embedding file up to date with the prompt index, encoding only the prompts that
+    are not in the current file (or in the prompt cache). An up-to-date file is left untouched.
+    Outputs: The store holding every prompt of the index.
+    """
+    store = PromptEmbeddingStore.load(manifest_path)
+    model_id = clip_model_id(clip_model)
+    if store is not None and store.matches(prompt_index, model_id):
+        return store
+
+    if prompt_cache is None:
+        prompt_cache = PromptEmbeddingCache(max(1024, len(prompt_index)), store)
+    text_features = prompt_index.text_matrix(clip_model, clip_processor, prompt_cache)
+    return save_prompt_embeddings(manifest_path, prompt_index, text_features, model_id)
+
+
+def _atomic_write(directory: str, path: str, write, mode: str, permissions: int):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as file:
+            write(file)
+        # mkstemp creates the file owner-only:
+        os.chmod(tmp_path, permissions)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+if __name__ == "__main__":
+    from inference_handler.model_loader import ModelRegistry, get_label_prompts, load_clip_model
+    from inference_handler.prompt_index import PromptIndex
+    from utils.config_loader import load_config
+
+    parser = argparse.ArgumentParser(description="Precompute the text embeddings of every registered gating prompt.")
+    parser.add_argument("--output", default=None, help="Manifest path (default: clip.embedding_index in utils/config.yaml).")
+    args = parser.parse_args()
+
+    config = load_config()
+    manifest_path = args.output or config["clip"]["embedding_index"]
+
+    # Label prompts need the class names, so only the models listed under label_prompts are loaded:
+    label_prefixes = config.get("label_prompts") or {}
+    models = ModelRegistry(config["models"], max_loaded=max(1, len(label_prefixes)))
+    label_prompts = get_label_prompts({name: models[name] for name in label_prefixes}, label_prefixes)
+    prompt_index = PromptIndex.from_text_prompts(config["text_prompts"], label_prompts)
+
+    clip_model, clip_processor = load_clip_model()
+    store = build_prompt_embeddings(manifest_path, prompt_index, clip_model, clip_processor)
+    print(f"{manifest_path}: revision {store.revision}, {len(store)} prompts, {store.matrix.shape[1]} dims")
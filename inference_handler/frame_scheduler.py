@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable
+import threading
+from inference_handler.torch_threads import use_threads
+
+
+class FrameScheduler:
+    """
+    Per-client, latest-frame-only scheduler for live inference.
+    Every session has a single pending slot: a frame that arrives while the previous one is still waiting
+    replaces it and is counted as dropped. Frames of one session are processed in order, one at a time,
+    on a shared worker pool, so the socket loop never blocks on inference and latency stays bounded.
+    """
+
+    def __init__(self, process_frame: Callable[[Hashable, Any], Any], emit_result: Callable[[Hashable, Any], None],
+                 workers: int = 2):
+        self.process_frame = process_frame
+        self.emit_result = emit_result
+        self.processed = 0
+        # Monotonic over all sessions, unlike the per-session counts that are discarded on disconnect:
+        self.total_dropped = 0
+        self._pending: Dict[Hashable, Any] = {}
+        self._running = set()
+        self._dropped: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame", initializer=use_threads)
+
+    def submit(self, session_id: Hashable, frame: Any) -> int:
+        """
+        Usage: Queue the newest frame of a session, replacing any frame that has not been picked up yet.
+        Inputs: The session id, the frame payload
+        Outputs: Number of frames dropped for the session so far.
+        """
+        with self._lock:
+            if session_id in self._pending:
+                self._dropped[session_id] = self._dropped.get(session_id, 0) + 1
+                self.total_dropped += 1
+            self._pending[session_id] = frame
+
+            if session_id not in self._running:
+                self._running.add(session_id)
+                self._executor.submit(self._run, session_id)
+            return self._dropped.get(session_id, 0)
+
+    def dropped(self, session_id: Hashable) -> int:
+        with self._lock:
+            return self._dropped.get(session_id, 0)
+
+    def remove(self, session_id: Hashable):
+        """
+        Usage: Discard the pending frame and counter of a session, e.g. when its client disconnects.
+        total_dropped keeps the frames it dropped.
+        """
+        with self._lock:
+            self._pending.pop(session_id, None)
+            self._dropped.pop(session_id, None)
+
+    def _run(self, session_id: Hashable):
+        while True:
+            with self._lock:
+                if session_id not in self._pending:
+                    self._running.discard(session_id)
+                    return
+                frame = self._pending.pop(session_id)
+
+            # A failing frame must not stall the session, the next pending frame is still picked up:
+            try:
+                result = self.process_frame(session_id, frame)
+                self.emit_result(session_id, result)
+            except Exception as e:
+                print(f"Frame processing failed for {session_id}: {e}")
+
+            with self._lock:
+                self.processed += 1
@@ -4,6 +4,9 @@ from typing import List
 from werkzeug.datastructures import FileStorage
 import base64
 from io import BytesIO
+import cv2
+import numpy as np
+from inference_handler.metrics import metrics
 
 def prepare_input_images(path: str) -> List[Image.Image]:
     """
@@ -29,12 +32,39 @@ def prepare_image_from_bytes(file: FileStorage) -> Image.Image:
     Input: A binary image file
     Output: A PIL Image object.
     """
-    return Image.open(file.stream).convert("RGB")
+    with metrics.stage("decode"):
+        return Image.open(file.stream).convert("RGB")
 
 
 def prepare_image_from_base64(base64_string):
-    if "," in base64_string:
-        base64_string = base64_string.split(",")[1]
+    with metrics.stage("decode"):
+        if "," in base64_string:
+            base64_string = base64_string.split(",")[1]
 
-    image_data = base64.b64decode(base64_string)
-    return Image.open(BytesIO(image_data)).convert("RGB")
\ No newline at end of file
+        image_data = base64.b64decode(base64_string)
+        return Image.open(BytesIO(image_data)).convert("RGB")
+
+
+# Decodes straight to RGB where OpenCV supports it, saving the BGR -> RGB pass:
+_IMREAD_RGB = getattr(cv2, "IMREAD_COLOR_RGB", None)
+
+
+def prepare_image_from_jpeg(image_bytes) -> np.ndarray:
+    """
+    Usage: Decodes a raw JPEG (or PNG) frame sent as a binary socket attachment.
+    No base64 or PIL round-trip: the bytes are decoded once by OpenCV into an RGB array.
+    Input: The encoded image bytes
+    Output: RGB image as a NumPy array (HWC, uint8).
+    """
+    with metrics.stage("decode"):
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        if _IMREAD_RGB is not None:
+            image = cv2.imdecode(buffer, _IMREAD_RGB)
+        else:
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            if image is not None:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        if image is None:
+            raise ValueError("Image decoding failed")
+        return image
@@ -0,0 +1,155 @@
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond preprocessing up to multi-second video requests:
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+
+_NULL_TIMER = nullcontext()
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key: Iterable[Tuple[str, str]], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in label_key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+    Histograms and counters are keyed by name and labels. Values that other components already count
+    (cache hits, dropped frames, ...) are read at scrape time through registered collectors.
+    When disabled, timers are a shared no-op context manager and observations return immediately.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool):
+        self.enabled = enabled
+
+    def describe(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self._help[name] = help_text
+        self._buckets[name] = buckets
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def timer(self, name: str, **labels):
+        """
+        Usage: Context manager observing the wall-clock duration of its block into histogram name.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name, labels)
+
+    def stage(self, stage: str, **labels):
+        """
+        Usage: Shortcut for timing one pipeline stage into inference_stage_seconds.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer("inference_stage_seconds", dict(labels, stage=stage))
+
+    @contextmanager
+    def _timer(self, name: str, labels: Dict[str, str]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]):
+        """
+        Usage: Register a callable returning (name, type, help, labels, value) samples, evaluated on every scrape.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Usage: Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._histograms.items():
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(key, 'le="%s"' % bound)
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    bucket_labels = _format_labels(key, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{bucket_labels} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+
+            for name, series in self._counters.items():
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+        described = set()
+        for collector in self._collectors:
+            for name, metric_type, help_text, labels, value in collector():
+                if name not in described:
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    described.add(name)
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the inference handlers and served on /metrics:
+metrics = Metrics()
+metrics.describe("inference_stage_seconds", "Latency of each inference pipeline stage.")
+metrics.describe("inference_request_seconds", "End-to-end latency of each endpoint.")
+metrics.describe("inference_models_gated", "Number of YOLO models selected by the CLIP gate per image.", COUNT_BUCKETS)
+metrics.describe("inference_model_selected_total", "Times each YOLO model was selected by the CLIP gate.")
+metrics.describe("inference_batch_size", "Number of requests coalesced into each batched forward.", COUNT_BUCKETS)
@@ -1,20 +1,115 @@
-from typing import Dict, List, Tuple, cast, TYPE_CHECKING
+from typing import Dict, Iterable, List, Optional, Tuple, cast, TYPE_CHECKING
+from collections import OrderedDict
+from concurrent.futures import Future
 from ultralytics import YOLO    
 from transformers import CLIPModel, CLIPProcessor
+import os
 import re
+import stat
+import tempfile
+import threading
+import weakref
 import yaml
+from inference_handler.shared_backbone import layer_signatures
+
+try:
+    import fcntl
+except ImportError:
+    # Windows:
+    fcntl = None
+    import msvcrt
+
+
+_config_lock = threading.Lock()
 
 
 def update_config_yaml(model_name, text_prompts, config_path="utils/config.yaml"):
+    """
+    Usage: Adds (or replaces) a model and its text-prompts in the config file.
+    """
+    def edit(config):
+        config['models'][model_name] = f"models/{model_name}_best.pt"
+        config['text_prompts'][model_name] = text_prompts
 
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
+    _edit_config_yaml(config_path, edit)
 
-    config['models'][model_name] = f"models/{model_name}_best.pt"
-    config['text_prompts'][model_name] = text_prompts
 
-    with open(config_path, 'w') as f:
-        yaml.dump(config, f)
+def restore_config_yaml(model_name, previous_config, config_path="utils/config.yaml"):
+    """
+    Usage: Puts the entries of a model back as they were in previous_config (removing them if it had none),
+    e.g. to roll back a failed registration.
+    """
+    def edit(config):
+        for key in ('models', 'text_prompts'):
+            if model_name in previous_config[key]:
+                config[key][model_name] = previous_config[key][model_name]
+            else:
+                config[key].pop(model_name, None)
+
+    _edit_config_yaml(config_path, edit)
+
+
+def _edit_config_yaml(config_path, edit):
+    """
+    The read-modify-write runs under a thread lock and an exclusive file lock (_lock_exclusive), so concurrent
+    registrations from any process never lose each other's entries, and the new file is swapped
+    in with a rename, so readers never see a partially written config.
+    """
+    with _config_lock, open(config_path + ".lock", "w") as lock_file:
+        _lock_exclusive(lock_file)
+
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+
+        edit(config)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(config_path) or ".", suffix=".yaml.tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                yaml.dump(config, f)
+            # mkstemp creates the file owner-only, the config keeps its own permissions:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(config_path).st_mode))
+            os.replace(tmp_path, config_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _lock_exclusive(lock_file):
+    """
+    Blocks until this process holds the exclusive lock of an open file: flock on POSIX, a lock on the
+    first byte with msvcrt.locking on Windows. Either lock is released when the file is closed.
+    """
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+
+    lock_file.seek(0)
+    while True:
+        try:
+            # LK_LOCK gives up with OSError after retrying for about 10 seconds:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+_predict_locks: "weakref.WeakKeyDictionary[YOLO, threading.Lock]" = weakref.WeakKeyDictionary()
+_predict_locks_lock = threading.Lock()
+
+
+def predict_lock(model) -> threading.Lock:
+    """
+    Usage: The lock to hold around every predict call on a YOLO model shared between threads.
+    Model.predict assigns the call's arguments (conf, classes) to the model's predictor before the predictor
+    takes its own lock, so concurrent calls could otherwise run with each other's class filter. The predictor
+    runs one call at a time anyway, so holding the lock over the whole call costs no parallelism.
+    """
+    with _predict_locks_lock:
+        lock = _predict_locks.get(model)
+        if lock is None:
+            lock = _predict_locks[model] = threading.Lock()
+        return lock
 
 
 def get_class(model_class_dict):
@@ -33,6 +128,201 @@ def load_models(model_paths: Dict[str, str]) -> Dict[str, YOLO]:
     return {name: YOLO(path) for name, path in model_paths.items()}
 
 
+class ModelRegistry:
+    """
+    Lazily loaded, LRU-bounded collection of YOLO models keyed by name.
+    Weights are only loaded the first time a model is looked up (e.g. when the CLIP gate selects it).
+    At most max_loaded unpinned models - and, if set, max_memory_mb of weights - stay resident;
+    the least recently used ones are evicted. Pinned models are loaded up front and never evicted.
+    Weights are loaded outside the registry lock, so lookups of resident models never wait for a cold load;
+    concurrent lookups of a model that is being loaded wait for that one load.
+    With backbone_signatures, the layer signatures of every model are computed when it is loaded,
+    so that models sharing their leading layers can run them once (see shared_backbone).
+    """
+
+    def __init__(self, model_paths: Dict[str, str], max_loaded: int = 4, max_memory_mb: Optional[float] = None,
+                 pinned: Iterable[str] = (), loader=YOLO, backbone_signatures: bool = False):
+        self.max_loaded = max_loaded
+        self.max_memory_mb = max_memory_mb
+        self.pinned = set(pinned)
+        self.loads = 0
+        self.evictions = 0
+        self._paths = dict(model_paths)
+        self._loader = loader
+        self._loaded: "OrderedDict[str, YOLO]" = OrderedDict()
+        self._sizes_mb: Dict[str, float] = {}
+        self._signatures: Dict[str, List[str]] = {}
+        self._loading: Dict[str, Future] = {}
+        self.backbone_signatures = backbone_signatures
+        self._lock = threading.RLock()
+
+        for name in self.pinned:
+            if name in self._paths:
+                self[name]
+
+    def __getitem__(self, name: str) -> YOLO:
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+
+            path = self._paths[name]
+            future = self._loading.get(name)
+            if future is None:
+                future = self._loading[name] = Future()
+                loading = True
+            else:
+                loading = False
+
+        if not loading:
+            return future.result()
+
+        try:
+            model = self._loader(path)
+        except BaseException as error:
+            with self._lock:
+                if self._loading.get(name) is future:
+                    del self._loading[name]
+            future.set_exception(error)
+            raise
+
+        with self._lock:
+            # Unless the model was registered again while loading, in which case the new weights load on next use:
+            if self._loading.get(name) is future:
+                del self._loading[name]
+                self._install(name, model)
+        future.set_result(model)
+        return model
+
+    def _install(self, name: str, model: YOLO):
+        self._loaded[name] = model
+        self._sizes_mb[name] = model_size_mb(model)
+        if self.backbone_signatures and name not in self._signatures:
+            self._signatures[name] = layer_signatures(model)
+        self.loads += 1
+        self._evict(keep=name)
+
+    def __contains__(self, name) -> bool:
+        return name in self._paths
+
+    def __iter__(self):
+        return iter(list(self._paths))
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def keys(self) -> List[str]:
+        return list(self._paths)
+
+    def items(self):
+        """
+        Usage: Iterate over (name, model) pairs. This loads every registered model, one at a time.
+        """
+        for name in self.keys():
+            yield name, self[name]
+
+    def preload(self):
+        """
+        Usage: Load every registered model, e.g. before forking processes that share the weights copy-on-write.
+        Raises ValueError if the limits (max_loaded, max_memory_mb) cannot keep all of them resident.
+        """
+        unpinned = [name for name in self.keys() if name not in self.pinned]
+        if len(unpinned) > self.max_loaded:
+            raise ValueError(f"{len(unpinned)} unpinned models cannot all stay resident with max_loaded={self.max_loaded}")
+
+        for name in self.keys():
+            self[name]
+        evicted = [name for name in self.keys() if name not in self.loaded_names()]
+        if evicted:
+            raise ValueError(f"Models {evicted} cannot stay resident with max_memory_mb={self.max_memory_mb}")
+
+    def paths(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._paths)
+
+    def loaded_names(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def register(self, name: str, path: str, model: Optional[YOLO] = None):
+        """
+        Usage: Register (or replace) a model path. The weights are loaded on first use, unless
+        already loaded weights are passed as model (see load_weights).
+        """
+        with self._lock:
+            self._paths[name] = path
+            self._loading.pop(name, None)
+            self._loaded.pop(name, None)
+            self._sizes_mb.pop(name, None)
+            self._signatures.pop(name, None)
+            if model is not None:
+                self._install(name, model)
+
+    def unregister(self, name: str):
+        """
+        Usage: Remove a model and its weights from the registry.
+        """
+        with self._lock:
+            self._paths.pop(name, None)
+            self._loading.pop(name, None)
+            self._loaded.pop(name, None)
+            self._sizes_mb.pop(name, None)
+            self._signatures.pop(name, None)
+
+    def signatures(self, name: str) -> Optional[List[str]]:
+        """
+        Usage: Layer signatures of a model that has been loaded at least once, or None.
+        """
+        return self._signatures.get(name)
+
+    def load_weights(self, path: str) -> YOLO:
+        """
+        Usage: Load and validate detection weights without touching the registry, so that a new model
+        can be prepared off the request path and then swapped in with register.
+        Outputs: The loaded model. Raises ValueError if the file is not a YOLO detection model.
+        """
+        try:
+            model = self._loader(path)
+        except Exception as error:
+            raise ValueError(f"Could not load YOLO weights from '{path}': {error}") from error
+
+        task = getattr(model, "task", "detect")
+        if task != "detect" or not getattr(model, "names", None):
+            raise ValueError(f"'{path}' is not a YOLO detection model (task: {task})")
+        return model
+
+    def _resident_mb(self) -> float:
+        return sum(self._sizes_mb.values())
+
+    def _evict(self, keep: str):
+        """
+        Usage: Evict least recently used unpinned models until the count and memory limits hold.
+        The model that was just requested is never evicted.
+        """
+        while True:
+            unpinned = [name for name in self._loaded if name not in self.pinned and name != keep]
+            over_count = len(unpinned) + (keep not in self.pinned) > self.max_loaded
+            over_memory = self.max_memory_mb is not None and self._resident_mb() > self.max_memory_mb
+            if not unpinned or not (over_count or over_memory):
+                return
+            name = unpinned[0]
+            del self._loaded[name]
+            del self._sizes_mb[name]
+            self.evictions += 1
+
+
+def model_size_mb(model) -> float:
+    """
+    Usage: Approximate resident size of a model's weights in megabytes.
+    """
+    module = getattr(model, "model", model)
+    if not hasattr(module, "parameters"):
+        return 0.0
+    n_bytes = sum(p.numel() * p.element_size() for p in module.parameters())
+    n_bytes += sum(b.numel() * b.element_size() for b in module.buffers())
+    return n_bytes / (1024 * 1024)
+
+
 def load_clip_model() -> Tuple[CLIPModel, CLIPProcessor]:
     """
     Usage: Returns the CLIP model and processor.
@@ -65,20 +355,35 @@ def clean_labels(label_list: List[str]) -> List[str]:
     return cleaned_label_list
 
 
-def get_text_prompts(models: Dict[str, YOLO], input_text_dict: Dict[str, str], text_to_model_dict: Dict[str, YOLO]):
+def get_text_prompts(models: Dict[str, YOLO], input_text_dict: Dict[str, str], text_to_model_dict: Dict[str, str]):
     """
     Usage: Get text-prompts for CLIP using the YOLO model labels.
     This function generates text prompts by prepending a base input text to each label from the YOLO model.
     Inputs:
     - model: The YOLO model to be used for object detection.
     - input_text: The base text to prepend to each label.
-    - text_prompts: A dictionary to store the generated text prompts with their associated models.
+    - text_prompts: A dictionary to store the generated text prompts with the names of their associated models.
     Outputs: None (the text_prompts dictionary is modified in place).
     """
-    for name, model in models.items():
-        label_names = model.names
-        label_list = list(label_names.values())
-        cleaned_label_list = clean_labels(label_list)
-        for label in cleaned_label_list:
+    for name, class_prompts in get_label_prompts(models, input_text_dict).items():
+        for prompt in class_prompts.values():
             # Create a unique key for each text-prompt:
-            text_to_model_dict[f"{input_text_dict[name]} {label}"] = model
+            text_to_model_dict[prompt] = name
+
+
+def get_label_prompts(models: Dict[str, YOLO], input_text_dict: Dict[str, str]) -> Dict[str, Dict[int, str]]:
+    """
+    Usage: Get one text-prompt per YOLO class label, keeping the class id of each prompt.
+    Inputs:
+    - models: Dictionary of YOLO models keyed by name.
+    - input_text_dict: The base text to prepend to the labels of each model.
+    Outputs: Dictionary of model name -> {class id: text-prompt}, as used by PromptIndex.from_text_prompts.
+    """
+    label_prompts = {}
+    for name, model in models.items():
+        class_ids = list(model.names.keys())
+        cleaned_label_list = clean_labels(list(model.names.values()))
+        label_prompts[name] = {
+            class_id: f"{input_text_dict[name]} {label}" for class_id, label in zip(class_ids, cleaned_label_list)
+        }
+    return label_prompts
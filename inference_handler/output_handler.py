@@ -71,6 +71,36 @@ def annotate_image(image, prompt_to_prob):
     return buffer 
 
 
+def annotate_frame(frame, prompt_to_prob):
+    frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    return draw_prompt_lines(frame_bgr, prompt_lines(prompt_to_prob))
+
+
+def prompt_lines(prompt_to_prob) -> List[str]:
+    """
+    Usage: The text lines annotate_frame draws for a {prompt: probability} dict, most probable first.
+    """
+    sorted_prompt_to_prob = sorted(prompt_to_prob.items(), key=lambda item: -item[1])
+    return [f"{prompt} ({prob:.2f})" for prompt, prob in sorted_prompt_to_prob]
+
+
+def draw_prompt_lines(frame_bgr, lines):
+    """
+    Usage: Draws prompt_lines onto a BGR frame in place and returns the frame.
+    """
+    y_offset = 30
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.7
+    thickness = 2
+    colour = (0, 0, 0)
+
+    for text in lines:
+        cv2.putText(frame_bgr, text, (10, y_offset), font, font_scale, colour, thickness)
+        y_offset += 30
+
+    return frame_bgr
+
+
 def save_combined_result(image):
     """
     Saves YOLO predictions to in-memory buffers instead of disk.
@@ -87,65 +117,146 @@ def save_combined_result(image):
     return img_io
  
 
-def draw_combined_predictions(predictions, image):
-    # Convert PIL to OpenCV format (RGB → BGR)
-    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-    label_colors = {}
-
-    for model_name, result in predictions.items():
-        if not result or len(result) == 0:
-            continue
+def draw_combined_predictions(predictions, image, model_classes=None):
+    """
+    Draws the boxes of every model on the image (PIL or RGB array) and returns it as a BGR array.
+    """
+    return draw_detections(image, extract_combined_predictions(predictions, model_classes))
 
-        boxes = result[0].boxes
-        names = result[0].names
 
-        for box in boxes:
-            cls_id = int(box.cls)
-            label = names[cls_id]
-            conf = float(box.conf)  # confidence score
-            
-            """
-            if label not in label_colors:
-                label_colors[label] = tuple(random.randint(0, 255) for _ in range(3))
-            """
-            color = (0, 0 ,0)
+def draw_detections(image, detections):
+    # Convert PIL to OpenCV format (RGB → BGR)
+    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    color = (0, 0 ,0)
 
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
+    if len(detections) == 0:
+        return image
 
-            # Format: label: 0.92
-            label_text = f"{label}: {conf:.2f}"
-            print(f"{label_text}, box: {(x1, y1), (x2, y2)}")
+    # All rectangles in one call, as closed 4-point polylines:
+    x1, y1, x2, y2 = detections.boxes.astype(np.int32).T
+    corners = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y2], 1), np.stack([x1, y2], 1)], 1)
+    cv2.polylines(image, list(corners), True, color, 2)
 
-            cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(image, label_text, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 1.4, color, 4)
+    # Format: label: 0.92
+    for text, left, top in zip(detections.texts(), x1.tolist(), y1.tolist()):
+        cv2.putText(image, text, (left, top - 5), cv2.FONT_HERSHEY_SIMPLEX, 1.4, color, 4)
 
     return image
 
-def extract_combined_predictions(predictions):
-    results = []
-
-    for model_name, result in predictions.items():
-        if not result or len(result) == 0:
-            continue
-
-        boxes = result[0].boxes
-        names = result[0].names
-
-        for box in boxes:
-            cls_id = int(box.cls)
-            label = names[cls_id]
-            conf = float(box.conf)
 
-            label_text = f"{label}: {conf:.2f}"
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
+def extract_combined_predictions(predictions, model_classes=None) -> "Detections":
+    """
+    Collects the boxes of every model into one columnar Detections.
+    model_classes optionally maps model names to the class ids to keep (None keeps all).
+    """
+    return Detections.from_predictions(predictions, model_classes)
 
-            results.append({
-                "label": label,
-                "confidence": conf,
-                "text": label_text,
-                "box": (x1, y1, x2, y2)
-            })
 
-    return results
+class Detections:
+    """
+    Columnar detections of one image across models: boxes [N, 4] (x1, y1, x2, y2), scores [N],
+    class_ids [N] and model_ids [N] indexing model_names, plus the class names of every model.
+    Built with one device-to-host transfer per model; serialized as arrays (to_json) or binary columns (pack).
+    """
 
+    def __init__(self, boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, model_ids: np.ndarray,
+                 model_names: List[str], class_names: List[Dict[int, str]]):
+        self.boxes = boxes
+        self.scores = scores
+        self.class_ids = class_ids
+        self.model_ids = model_ids
+        self.model_names = model_names
+        self.class_names = class_names
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @classmethod
+    def from_predictions(cls, predictions: Dict[str, "Results"], model_classes=None) -> "Detections":
+        if model_classes is None:
+            model_classes = {}
+
+        boxes, scores, class_ids, model_ids = [], [], [], []
+        model_names, class_names = [], []
+
+        for model_name, result in predictions.items():
+            if isinstance(result, list):
+                result = result[0] if result else None
+            if result is None or result.boxes is None or len(result.boxes) == 0:
+                continue
+
+            # [n, 6] rows of x1, y1, x2, y2, (track id,) confidence, class:
+            data = result.boxes.data.cpu().numpy()
+            model_class_ids = data[:, -1].astype(np.int32)
+
+            class_filter = model_classes.get(model_name)
+            keep = np.isin(model_class_ids, class_filter) if class_filter is not None else slice(None)
+
+            model_id = len(model_names)
+            model_names.append(model_name)
+            class_names.append(result.names)
+
+            boxes.append(data[keep, :4].astype(np.float32))
+            scores.append(data[keep, -2].astype(np.float32))
+            class_ids.append(model_class_ids[keep])
+            model_ids.append(np.full(len(class_ids[-1]), model_id, dtype=np.int32))
+
+        if not boxes:
+            return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32),
+                       np.zeros(0, np.int32), model_names, class_names)
+        return cls(np.concatenate(boxes), np.concatenate(scores), np.concatenate(class_ids),
+                   np.concatenate(model_ids), model_names, class_names)
+
+    def labels(self):
+        """
+        Usage: Label table and the label index of every box; boxes of different models with the same
+        class name share one label.
+        Outputs: Tuple of the label names and an int array [N].
+        """
+        if len(self) == 0:
+            return [], np.zeros(0, dtype=np.int64)
+
+        pairs, inverse = np.unique(np.stack([self.model_ids, self.class_ids], 1), axis=0, return_inverse=True)
+        pair_labels = [self.class_names[model_id][class_id] for model_id, class_id in pairs.tolist()]
+
+        labels = list(dict.fromkeys(pair_labels))
+        pair_index = np.array([labels.index(label) for label in pair_labels], dtype=np.int64)
+        return labels, pair_index[inverse.reshape(-1)]
+
+    def texts(self) -> List[str]:
+        labels, label_ids = self.labels()
+        return [f"{labels[label_id]}: {score:.2f}" for label_id, score in zip(label_ids.tolist(), self.scores.tolist())]
+
+    def rescaled(self, scale_x: float, scale_y: float) -> "Detections":
+        """
+        Usage: Maps boxes detected on a downscaled frame back to the coordinates of the client's source frame.
+        """
+        boxes = self.boxes * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        return Detections(boxes, self.scores, self.class_ids, self.model_ids, self.model_names, self.class_names)
+
+    def to_json(self) -> Dict:
+        """
+        Usage: JSON-serializable columns: boxes as [x1, y1, x2, y2] pixel rows, scores, and label_ids indexing labels.
+        """
+        labels, label_ids = self.labels()
+        return {
+            "count": len(self),
+            "labels": labels,
+            "label_ids": label_ids.tolist(),
+            "boxes": self.boxes.astype(np.int32).tolist(),
+            "scores": self.scores.tolist(),
+        }
+
+    def pack(self) -> Dict:
+        """
+        Usage: Little-endian binary columns sent as socket attachments:
+        boxes (uint16, N x [x1, y1, x2, y2]), scores (float32) and label_ids (uint16) indexing labels.
+        """
+        labels, label_ids = self.labels()
+        return {
+            "count": len(self),
+            "labels": labels,
+            "boxes": np.clip(np.round(self.boxes), 0, 65535).astype("<u2").tobytes(),
+            "scores": self.scores.astype("<f4").tobytes(),
+            "label_ids": label_ids.astype("<u2").tobytes(),
+        }
@@ -4,51 +4,71 @@ import json
 import os
 from PIL import Image
 import numpy as np
+import cv2
 from scipy.stats import mode
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from inference_handler.prompt_cache import PromptEmbeddingCache, as_embeddings
+from inference_handler.preprocessing import get_preprocessor
+from inference_handler.metrics import metrics
+from inference_handler.model_loader import predict_lock
+from inference_handler.torch_threads import process_threads, use_threads
+from inference_handler.shared_backbone import plan_shared_runs, predictor_ready, run_shared
 time_taken_list = []
 
+# Reference dataset and gating prompts used by summary_statistics and benchmark.py:
+REFERENCE_IMAGE_DIR = 'dataset/reference_images/'
+REFERENCE_LABELS_PATH = 'dataset/labels/labels_new.json'
+ROAD_SCENE_PROMPT = "A road scene where {} is visible"
+ROAD_SCENE_LABELS = ["a street light", "an animal", "Pot Hole in road", "Crack on Road", "Broken Pavement", 
+                     "Fallen Tree blocking road", "Fallen Electric Pole blocking road", 
+                     "Traffic Light", "Traffic Cone", "bike", 
+                     "car", "Bus", "Jeep", "Truck", "Cycle", "Pedestrian", 
+                     "painted traffic line", "Hanging Power Line", "Broken Divider",]
 
-def return_top_prompts(image, prompt_list, prompt_to_model_dict, clip_model, clip_processor, verbose):
+# Shared text-embedding store, used when the caller does not pass its own:
+default_prompt_cache = PromptEmbeddingCache()
+
+# Thread pools for parallel YOLO inference, keyed by worker count:
+_yolo_executors = {}
+_yolo_executor_lock = threading.Lock()
+
+
+def return_top_prompts(image, prompt_list, prompt_to_model_dict, clip_model, clip_processor, verbose, prompt_cache=None, tiling=None,
+                       gate_batcher=None):
 
     #total_count = len(prompt_list)
     #print(f"total classes: {total_count}")
- 
-    image_np = np.array(image)
-    highlight_fixed = suppress_highlights(image_np, threshold=200)
 
-    final_image = Image.fromarray(highlight_fixed)
-    inputs = clip_processor(text = prompt_list, images = final_image, return_tensors="pt", padding=True)
+    if not prompt_list:
+        return {}
+ 
     prompt_to_prob_dict = {}
 
-    with torch.no_grad():
-        outputs = clip_model(**inputs)
-        
-        # Get raw image/text features
-        image_features = outputs.image_embeds  # [1, hidden_dim]
-        text_features = outputs.text_embeds    # [num_classes, hidden_dim]
-        
-        # Normalize features
-        image_features = F.normalize(image_features, p=2, dim=-1)
-        text_features = F.normalize(text_features, p=2, dim=-1)
-        
+    if prompt_cache is None:
+        prompt_cache = default_prompt_cache
+
+    # Text features come pre-normalized from the cache, only the image tower runs per frame:
+    text_features = prompt_cache.get_text_matrix(prompt_list, clip_model, clip_processor)  # [num_classes, hidden_dim]
+    if gate_batcher is not None:
+        # The image encoder runs in one batch with the concurrent requests of other clients:
+        probs, significant_mask = gate_batcher((image, text_features))
+    else:
+        views = tiling.views(image) if tiling is not None else [image]
+        image_features = encode_images(views, clip_model, clip_processor, len(views))  # [num_views, hidden_dim]
+
         # Cosine similarities
-        sims = image_features @ text_features.T  # [1, num_classes]
+        sims = image_features @ text_features.T  # [num_views, num_classes]
+        if tiling is not None:
+            sims = tiling.aggregate(sims)  # [1, num_classes]
+        probs, significant_mask = significant_prompts(sims)
 
-        if len(prompt_list) == 1:
-            prob = torch.sigmoid(sims[0])  
-            return {prompt_list[0]: prob.item()}
-        
-        # Z-score normalization
-        sims_norm = (sims - sims.mean()) / sims.std()
+    if len(prompt_list) == 1:
+        return {prompt_list[0]: probs[0, 0].item()}
 
-        # Apply sigmoid
-        probs = torch.sigmoid(sims_norm)[0]   # [num_classes]
-        
-    # Keep anything above average OR reasonably close to top
-    sig_z = (sims_norm[0] > 0.2)
-    sig_val = (probs >= 0.8 * probs.max())
-    significant_indices = (sig_z | sig_val).nonzero(as_tuple=True)[0]
+    probs = probs[0]   # [num_classes]
+    significant_indices = significant_mask[0].nonzero(as_tuple=True)[0]
     count = 0
     
     if (verbose):
@@ -72,83 +92,320 @@ def return_top_prompts(image, prompt_list, prompt_to_model_dict, clip_model, cli
     return sorted_prompt_to_prob
 
 
+def return_top_prompts_batch(images, prompt_list, clip_model, clip_processor, batch_size=16, prompt_cache=None, tiling=None):
+    """
+    Usage: Batched version of return_top_prompts, scoring many images against one prompt set.
+    The image encoder runs over micro-batches of batch_size images and the gating rule is applied to all rows at once.
+    Inputs:
+    - images: List of PIL images / RGB arrays, or a stacked RGB array of shape [num_images, H, W, 3].
+    - prompt_list: The text-prompts shared by all images.
+    - batch_size: Number of images per image-encoder forward.
+    - tiling: Optional TileGrid, scoring every image as its global view plus a grid of crops.
+    Outputs: List with one {prompt: probability} dict per image, holding only the significant prompts sorted by probability.
+    """
+    if len(images) == 0:
+        return []
+    if not prompt_list:
+        return [{} for _ in range(len(images))]
+
+    if prompt_cache is None:
+        prompt_cache = default_prompt_cache
+
+    text_features = prompt_cache.get_text_matrix(prompt_list, clip_model, clip_processor)  # [num_classes, hidden_dim]
+    probs, significant_mask = gate_images(images, text_features, clip_model, clip_processor, batch_size, tiling)
+
+    # Order each row by probability once, then keep the significant entries:
+    order = torch.argsort(probs, dim=-1, descending=True)
+    sorted_probs = torch.gather(probs, -1, order).tolist()
+    sorted_mask = torch.gather(significant_mask, -1, order).tolist()
+    order = order.tolist()
+
+    return [
+        {prompt_list[idx]: prob for idx, prob, keep in zip(row_order, row_probs, row_mask) if keep}
+        for row_order, row_probs, row_mask in zip(order, sorted_probs, sorted_mask)
+    ]
+
+
+def gate_images(images, text_features, clip_model, clip_processor, batch_size=16, tiling=None):
+    """
+    Usage: Scores the images against pre-normalized text features and applies the gating rule.
+    With a TileGrid, all views of batch_size images go through the image encoder together and
+    their similarities are aggregated per image before gating.
+    Inputs: List of PIL images / RGB arrays, text features [num_classes, hidden_dim], the CLIP model and processor.
+    Outputs: Tuple of probabilities and a boolean significance mask, both [num_images, num_classes].
+    """
+    if tiling is None:
+        image_features = encode_images(images, clip_model, clip_processor, batch_size)  # [num_images, hidden_dim]
+        return score_prompts(image_features, text_features)
+
+    views = tiling.expand(images)
+    image_features = encode_images(views, clip_model, clip_processor, batch_size * tiling.views_per_image)
+    sims = tiling.aggregate(image_features @ text_matrix(text_features).T)  # [num_images, num_classes]
+    return significant_prompts(sims)
+
+
+def score_prompts(image_features, text_features):
+    """
+    Usage: Applies the gating rule to normalized image features. A text-feature matrix is scored against
+    every prompt; a PromptSearchIndex (large prompt vocabularies) only ranks its top-k prompts.
+    Outputs: Tuple of probabilities and a boolean significance mask, both [num_images, num_classes].
+    """
+    if torch.is_tensor(text_features):
+        return significant_prompts(image_features @ text_features.T)
+    return text_features.significant_prompts(image_features)
+
+
+def text_matrix(text_features):
+    # Tiled similarities are aggregated over views before gating, so a search index is scored exhaustively:
+    return text_features if torch.is_tensor(text_features) else text_features.text_features
+
+
+def gate_batch(items, clip_model, clip_processor, batch_size=16, tiling=None):
+    """
+    Usage: Gates images that come with different prompt sets (e.g. the pending frames of several clients):
+    all images go through the image encoder together, then every image is scored against its own text features.
+    Inputs: List of (image, text features [num_classes, hidden_dim] or PromptSearchIndex) pairs, the CLIP model and processor, optionally a TileGrid.
+    Outputs: List with one (probabilities, significance mask) pair per image, both [1, num_classes].
+    """
+    images = [image for image, _ in items]
+    if tiling is None:
+        image_features = encode_images(images, clip_model, clip_processor, batch_size)  # [num_images, hidden_dim]
+    else:
+        image_features = encode_images(tiling.expand(images), clip_model, clip_processor, batch_size * tiling.views_per_image)
+
+    gated = []
+    for index, (_, text_features) in enumerate(items):
+        if tiling is None:
+            gated.append(score_prompts(image_features[index:index + 1], text_features))
+        else:
+            views = image_features[index * tiling.views_per_image:(index + 1) * tiling.views_per_image]
+            gated.append(significant_prompts(tiling.aggregate(views @ text_matrix(text_features).T)))  # [1, num_classes]
+    return gated
+
+
+def select_models(image, prompt_index, clip_model, clip_processor, prompt_cache=None, tiling=None, gate_batcher=None,
+                  prompt_search=None):
+    """
+    Usage: Gates the image against every prompt of the prompt index and returns the models to run.
+    Inputs: The image, a PromptIndex, the CLIP model and processor, optionally a TileGrid, a
+    MicroBatcher over gate_batch to encode the image together with concurrent requests, and the
+    PromptSearchIndex parameters (top_k, exact_threshold, nlist, nprobe) for large prompt vocabularies
+    Outputs: Dictionary of model name -> class ids whose prompts were significant
+    (None when a model-level prompt selected the whole model), for every selected model.
+    """
+    if len(prompt_index) == 0:
+        return {}
+
+    if prompt_cache is None:
+        prompt_cache = default_prompt_cache
+
+    if prompt_search:
+        text_features = prompt_index.search_index(clip_model, clip_processor, prompt_cache, **prompt_search)
+    else:
+        text_features = prompt_index.text_matrix(clip_model, clip_processor, prompt_cache)
+    if gate_batcher is not None:
+        _, significant_mask = gate_batcher((image, text_features))
+    else:
+        _, significant_mask = gate_images([image], text_features, clip_model, clip_processor, tiling=tiling)
+
+    with metrics.stage("model_selection"):
+        model_classes = prompt_index.classes_for(significant_mask[0])
+
+    metrics.observe("inference_models_gated", len(model_classes))
+    for name in model_classes:
+        metrics.inc("inference_model_selected_total", model=name)
+    return model_classes
+
+
+def encode_images(images, clip_model, clip_processor, batch_size=16):
+    """
+    Usage: Runs the CLIP image encoder over the images in micro-batches.
+    Images are downsized, highlight-capped and normalized in a single pass by the ClipPreprocessor.
+    Inputs: List of PIL images / RGB arrays, the CLIP model and processor, and the micro-batch size.
+    Outputs: L2-normalized image features of shape [num_images, hidden_dim].
+    """
+    preprocessor = get_preprocessor(clip_processor)
+
+    features = []
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            with metrics.stage("preprocess"):
+                pixel_values = preprocessor.preprocess(list(images[start:start + batch_size]))
+            with metrics.stage("clip_image"):
+                batch_features = as_embeddings(clip_model.get_image_features(pixel_values=pixel_values))
+            features.append(F.normalize(batch_features, p=2, dim=-1))
+    return torch.cat(features)
+
+
+def significant_prompts(sims):
+    """
+    Usage: Applies the gating rule to the cosine similarities of every image at once.
+    Similarities are z-scored per image and passed through a sigmoid. A prompt is significant if it is
+    above average (z > 0.2) OR reasonably close to the top (prob >= 0.8 * max).
+    A single prompt cannot be z-scored, so its raw similarity goes through the sigmoid and it is always kept.
+    Inputs: Tensor of cosine similarities [num_images, num_classes]
+    Outputs: Tuple of probabilities and a boolean significance mask, both [num_images, num_classes].
+    """
+    if sims.shape[-1] == 1:
+        probs = torch.sigmoid(sims)
+        return probs, torch.ones_like(probs, dtype=torch.bool)
+
+    # Z-score normalization
+    sims_norm = (sims - sims.mean(dim=-1, keepdim=True)) / sims.std(dim=-1, keepdim=True)
+
+    # Apply sigmoid
+    probs = torch.sigmoid(sims_norm)
+
+    # Keep anything above average OR reasonably close to top
+    sig_z = (sims_norm > 0.2)
+    sig_val = (probs >= 0.8 * probs.max(dim=-1, keepdim=True).values)
+    return probs, sig_z | sig_val
+
+
 # Function to return the models to run for the image:
 def models_to_run(prompt_to_prob_dict, prompt_to_model_dict):
 
     return list({ prompt_to_model_dict[prompt] for prompt in prompt_to_prob_dict if prompt in prompt_to_model_dict })
 
 
-# Function to return a list of model names given the model:
-def model_name_list(model_list, name_to_model_dict):
-    model_names = []
-    for model in model_list:
-        for name, model_2 in name_to_model_dict.items():
-            if model == model_2:
-                model_names.append(name)
-    print(model_names)
-    return model_names
-
+def run_best_yolo_models(image, models, top_model_names, confidence, workers=1, model_classes=None,
+                         shared_backbone=False, min_shared_layers=1, yolo_batchers=None):
+    """
+    Usage: Runs the selected YOLO models on the image.
+    With workers > 1 the models run concurrently on a thread pool (torch releases the GIL),
+    so the frame latency approaches that of the slowest model instead of the sum of all of them.
+    With shared_backbone, selected models whose leading layers are identical (see ModelRegistry
+    backbone_signatures) run those layers once and only their own remaining layers separately;
+    all other models, and models that have not run once yet, fall back to separate runs.
+    With yolo_batchers (see batching.YoloBatchers), each separate run is batched with the concurrent
+    frames of other clients that selected the same model.
+    Inputs: The image (PIL or RGB array), the dictionary of YOLO models, the selected model names, the confidence threshold,
+    the number of models to run in parallel and, optionally, the class ids to detect per model
+    (as returned by select_models; None runs all classes).
+    Outputs: Dictionary of YOLO Results keyed by model name, in the order of top_model_names.
+    """
+    if model_classes is None:
+        model_classes = {}
+    # Arrays in this repo are RGB, ultralytics reads arrays as BGR; convert once for all models:
+    if isinstance(image, np.ndarray):
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
-def run_best_yolo_models(image, models, top_model_names, confidence):
+    def predict(name):
+        model = models[name]
+        with metrics.stage("yolo", model=name):
+            if yolo_batchers is not None:
+                return [yolo_batchers.predict(name, image, confidence, model_classes.get(name))]
+            with predict_lock(model):
+                return model.predict(source = image, conf = confidence, classes = model_classes.get(name), verbose = False)
 
     predictions = {}
-    for name in top_model_names:
-        model = models[name]
-        results = model.predict(source = image, conf = confidence, verbose = True)
+    separate = list(top_model_names)
+    if shared_backbone and len(top_model_names) > 1 and hasattr(models, "signatures"):
+        predictions, separate = run_shared_models(image, models, top_model_names, confidence, model_classes, min_shared_layers)
+
+    if workers <= 1 or len(separate) <= 1:
+        for name in separate:
+            results = predict(name)
+
+            if results:
+                predictions[name] = results[0]
+    else:
+        executor = get_yolo_executor(workers)
+        futures = {name: executor.submit(predict, name) for name in separate}
 
-        if results:
-            predictions[name] = results[0]
-    return predictions
+        for name, future in futures.items():
+            results = future.result()
 
+            if results:
+                predictions[name] = results[0]
 
-def suppress_highlights(image, threshold=240):
+    return {name: predictions[name] for name in top_model_names if name in predictions}
+
+
+def run_shared_models(image, models, top_model_names, confidence, model_classes, min_shared_layers=1):
     """
-    Caps overly bright pixel values to suppress highlights (like headlights).
-    - image: RGB image as a NumPy array
-    - threshold: max brightness per channel (0-255)
+    Usage: Runs the groups of selected models that share leading layers through one shared forward.
+    Inputs: The BGR image, the ModelRegistry, the selected model names, the confidence threshold,
+    the class ids per model and the minimum number of shared layers worth grouping on.
+    Outputs: Tuple of the Results of the grouped models and the names that still need a separate run.
     """
-    return np.minimum(image, threshold).astype(np.uint8)
+    loaded = {name: models[name] for name in top_model_names}
+    groups, separate = plan_shared_runs(
+        list(top_model_names), {name: models.signatures(name) for name in top_model_names}, min_shared_layers
+    )
+
+    predictions = {}
+    for prefix, names in groups:
+        group = {name: loaded[name] for name in names}
+        # Predictors (letterbox, NMS) are set up by a model's first regular run:
+        if not predictor_ready(list(group.values())):
+            separate.extend(names)
+            continue
+
+        try:
+            with metrics.stage("yolo_shared", models=",".join(names)):
+                predictions.update(run_shared(image, group, prefix, confidence, model_classes))
+        except Exception as error:
+            print(f"Shared backbone run failed for {names}, running them separately: {error}")
+            separate.extend(names)
+
+    return predictions, separate
 
 
-def summary_statistics(prompt_to_model_dict, clip_model, clip_processor):
-    with open('dataset/labels/labels_new.json', 'r') as file:
+def get_yolo_executor(workers):
+    """
+    Usage: Returns the shared thread pool used to run YOLO models in parallel, creating it on first use.
+    Every worker thread gets an equal share of the process's torch intra-op threads so that concurrent models
+    do not oversubscribe the cores; the budget of the other threads is left alone (see torch_threads).
+    """
+    with _yolo_executor_lock:
+        if workers not in _yolo_executors:
+            threads_per_worker = max(1, process_threads() // workers)
+            _yolo_executors[workers] = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="yolo",
+                initializer=use_threads,
+                initargs=(threads_per_worker,),
+            )
+        return _yolo_executors[workers]
+
+
+def summary_statistics(prompt_to_model_dict, clip_model, clip_processor, batch_size=16, tiling=None):
+    with open(REFERENCE_LABELS_PATH, 'r') as file:
         data = json.load(file)
     
-    image_dir = 'dataset/reference_images/'
+    image_dir = REFERENCE_IMAGE_DIR
     
-    prompts = ["a street light", "an animal", "Pot Hole in road", "Crack on Road", "Broken Pavement", 
-               "Fallen Tree blocking road", "Fallen Electric Pole blocking road", 
-               "Traffic Light", "Traffic Cone", "bike", 
-               "car", "Bus", "Jeep", "Truck", "Cycle", "Pedestrian", 
-               "painted traffic line", "Hanging Power Line", "Broken Divider",] 
+    prompts = ROAD_SCENE_LABELS
 
-    prompt_list = [f"A road scene where {prompt} is visible" for prompt in prompts]
+    prompt_list = [ROAD_SCENE_PROMPT.format(prompt) for prompt in prompts]
   
     extra_count_array = np.array([])
     count = 0
     
     missed_model_dict = {prompt:0 for prompt in prompts}
+    prompt_to_label_dict = {prompt:label for prompt, label in zip(prompt_list, prompts)}
 
-    for path, folder, files in os.walk(image_dir):
+    filenames = [filename for path, folder, files in os.walk(image_dir) for filename in files]
 
-        for filename in files: 
-            start_time = time.time()
+    for batch_start in range(0, len(filenames), batch_size):
+        batch_filenames = filenames[batch_start:batch_start + batch_size]
+        start_time = time.time()
 
-            count+= 1
-            predicted_labels = []
-            ground_truth_labels = []
+        batch_images = []
+        for filename in batch_filenames:
             image_file = os.path.join(image_dir, filename)
-            image = Image.open(image_file).convert("RGB")
+            batch_images.append(Image.open(image_file).convert("RGB"))
 
-            prompt_to_label_dict = {prompt:label for prompt, label in zip(prompt_list, prompts)}
+        batch_prompt_to_prob = return_top_prompts_batch(batch_images, prompt_list, clip_model, clip_processor, batch_size, tiling=tiling)
 
-            image_np = np.array(image)
+        # Time per image is amortized over the batch:
+        elapsed_time = (time.time() - start_time) / len(batch_filenames)
 
-            highlight_fixed = suppress_highlights(image_np, threshold=194)
-        
-            final_image = Image.fromarray(highlight_fixed)
-            
-            prompt_to_prob_dict = return_top_prompts(final_image, prompt_list, prompt_to_model_dict, clip_model, clip_processor, False)
+        for filename, prompt_to_prob_dict in zip(batch_filenames, batch_prompt_to_prob):
+            count+= 1
+            predicted_labels = []
+            ground_truth_labels = []
 
             for prompt, prob in prompt_to_prob_dict.items():
                 if prompt in prompt_to_label_dict:
@@ -183,7 +440,6 @@ def summary_statistics(prompt_to_model_dict, clip_model, clip_processor):
             extra_count_array = np.append(extra_count_array, extra_count)
             print(f"Actual Count: {actual_count}, Extra Models: {extra_count}")
 
-            elapsed_time = time.time() - start_time
             print(f"Time taken: {elapsed_time:.2f} seconds")
             time_taken_list.append(elapsed_time)
 
@@ -217,15 +473,3 @@ def summary_statistics(prompt_to_model_dict, clip_model, clip_processor):
     print(f"Max Time: {np.max(time_taken_list):.2f} seconds")
     print(f"Min Time: {np.min(time_taken_list):.2f} seconds")
 
-
-def run_best_yolo_models(image, models, top_model_names, confidence):
-
-    predictions = {}
-    for name in top_model_names:
-        model = models[name]
-        results = model.predict(source = image, conf = confidence, verbose = True)
-
-        if results:
-            predictions[name] = results[0]
-    
-    return predictions
\ No newline at end of file
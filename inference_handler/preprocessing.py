@@ -0,0 +1,138 @@
+from typing import Dict, Tuple
+from PIL import Image
+import threading
+import cv2
+import numpy as np
+import torch
+
+# Brightness cap applied to CLIP inputs when no threshold is configured:
+DEFAULT_HIGHLIGHT_THRESHOLD = 194
+
+
+class ClipPreprocessor:
+    """
+    Drop-in replacement for the image half of a CLIPProcessor.
+    Each image is resized to the CLIP input resolution first; the highlight cap is then applied
+    in place on the small crop, which is rescaled and normalized straight into a reusable
+    per-thread input buffer. Text inputs are still handled by the wrapped processor.
+    """
+
+    def __init__(self, processor, highlight_threshold: int = DEFAULT_HIGHLIGHT_THRESHOLD, max_batch_size: int = 32):
+        self.processor = processor
+        self.highlight_threshold = highlight_threshold
+        self.max_batch_size = max_batch_size
+
+        image_processor = processor.image_processor
+        size = image_processor.size
+        crop_size = image_processor.crop_size if getattr(image_processor, "do_center_crop", True) else None
+
+        # Either resize the shortest edge and center crop, or resize straight to a fixed size:
+        self.shortest_edge = size.get("shortest_edge")
+        if crop_size:
+            self.crop_size = (crop_size["height"], crop_size["width"])
+        elif self.shortest_edge:
+            self.crop_size = (self.shortest_edge, self.shortest_edge)
+        else:
+            self.crop_size = (size["height"], size["width"])
+
+        # rescale and normalize folded into one multiply-add per pixel:
+        rescale_factor = getattr(image_processor, "rescale_factor", 1 / 255)
+        mean = np.asarray(image_processor.image_mean, dtype=np.float32)
+        std = np.asarray(image_processor.image_std, dtype=np.float32)
+        self._scale = (rescale_factor / std).reshape(3, 1, 1).astype(np.float32)
+        self._offset = (-mean / std).reshape(3, 1, 1).astype(np.float32)
+
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        # Everything else (tokenizer, image_processor, ...) comes from the wrapped processor:
+        if name == "processor":
+            raise AttributeError(name)
+        return getattr(self.processor, name)
+
+    def __call__(self, text=None, images=None, return_tensors="pt", padding=True, **kwargs) -> Dict[str, torch.Tensor]:
+        inputs = {}
+        if text is not None:
+            inputs.update(self.processor(text=text, return_tensors=return_tensors, padding=padding, **kwargs))
+        if images is not None:
+            inputs["pixel_values"] = self.preprocess(images)
+        return inputs
+
+    def preprocess(self, images) -> torch.Tensor:
+        """
+        Usage: Turn images into CLIP pixel values.
+        The returned tensor is a view of this thread's input buffer and is overwritten by the next call.
+        Inputs: A PIL image / RGB array, or a list of them
+        Outputs: Tensor of shape [num_images, 3, crop_height, crop_width].
+        """
+        if isinstance(images, Image.Image) or (isinstance(images, np.ndarray) and images.ndim == 3):
+            images = [images]
+
+        buffer = self._buffer(len(images))
+        for idx, image in enumerate(images):
+            crop = self.resize_and_crop(image)
+            np.minimum(crop, self.highlight_threshold, out=crop)
+
+            channels = buffer[idx]
+            np.multiply(crop.transpose(2, 0, 1), self._scale, out=channels)
+            channels += self._offset
+
+        return torch.from_numpy(buffer)
+
+    def resize_and_crop(self, image) -> np.ndarray:
+        """
+        Usage: Downsize an image to the CLIP input resolution before any other work is done on it.
+        Inputs: PIL image or RGB array
+        Outputs: Writable uint8 RGB array of shape [crop_height, crop_width, 3].
+        """
+        height, width = (image.height, image.width) if isinstance(image, Image.Image) else image.shape[:2]
+        out_height, out_width = self._resized_shape(height, width)
+
+        if isinstance(image, Image.Image):
+            resized = np.array(image.convert("RGB").resize((out_width, out_height), Image.BICUBIC))
+        else:
+            interpolation = cv2.INTER_AREA if out_height < height else cv2.INTER_CUBIC
+            resized = cv2.resize(np.ascontiguousarray(image), (out_width, out_height), interpolation=interpolation)
+
+        crop_height, crop_width = self.crop_size
+        top = max((out_height - crop_height) // 2, 0)
+        left = max((out_width - crop_width) // 2, 0)
+        crop = resized[top:top + crop_height, left:left + crop_width]
+
+        if crop.shape[:2] != (crop_height, crop_width):
+            crop = cv2.resize(crop, (crop_width, crop_height), interpolation=cv2.INTER_CUBIC)
+        return crop
+
+    def _resized_shape(self, height: int, width: int) -> Tuple[int, int]:
+        if not self.shortest_edge:
+            return self.crop_size
+        if height <= width:
+            return self.shortest_edge, max(int(self.shortest_edge * width / height), 1)
+        return max(int(self.shortest_edge * height / width), 1), self.shortest_edge
+
+    def _buffer(self, batch_size: int) -> np.ndarray:
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = np.empty((max(batch_size, self.max_batch_size), 3, *self.crop_size), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:batch_size]
+
+
+_preprocessors = {}
+_preprocessors_lock = threading.Lock()
+
+
+def get_preprocessor(clip_processor) -> ClipPreprocessor:
+    """
+    Usage: Returns clip_processor itself if it already is a ClipPreprocessor, otherwise a shared
+    ClipPreprocessor wrapping it with the default highlight threshold.
+    """
+    if isinstance(clip_processor, ClipPreprocessor):
+        return clip_processor
+
+    with _preprocessors_lock:
+        preprocessor = _preprocessors.get(id(clip_processor))
+        if preprocessor is None or preprocessor.processor is not clip_processor:
+            preprocessor = ClipPreprocessor(clip_processor)
+            _preprocessors[id(clip_processor)] = preprocessor
+        return preprocessor
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from typing import Hashable, List, Tuple
+import threading
+from inference_handler.metrics import metrics
+import torch
+import torch.nn.functional as F
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Usage: Normalize a text-prompt so that trivially different spellings share one cache entry.
+    The CLIP tokenizer lower-cases and collapses whitespace anyway, so this does not change the embedding.
+    Inputs: A text-prompt (string)
+    Outputs: The normalized prompt (string).
+    """
+    return " ".join(prompt.lower().split())
+
+
+def clip_model_id(clip_model) -> str:
+    """
+    Usage: Returns an identifier for the CLIP checkpoint, used to keep embeddings of different models apart.
+    Inputs: The CLIP model
+    Outputs: The checkpoint name, or the object id for models that were not loaded from a checkpoint.
+    """
+    name = getattr(clip_model, "name_or_path", "") or getattr(getattr(clip_model, "config", None), "_name_or_path", "")
+    return name or f"{type(clip_model).__name__}-{id(clip_model)}"
+
+
+def as_embeddings(features) -> torch.Tensor:
+    """
+    Usage: Newer transformers releases wrap get_image_features / get_text_features in a model output,
+    older ones return the projected tensor directly. This returns the tensor in both cases.
+    """
+    if torch.is_tensor(features):
+        return features
+    return features.pooler_output
+
+
+class PromptEmbeddingCache:
+    """
+    LRU store of L2-normalized CLIP text embeddings keyed by (model id, normalized prompt).
+    Prompts missing from the store are looked up in the precomputed embedding file, if one is given
+    (see embedding_index.PromptEmbeddingStore); only the remaining ones are sent through the text tower, in a single batch.
+    """
+
+    def __init__(self, max_size: int = 1024, precomputed=None):
+        self.max_size = max_size
+        self.precomputed = precomputed
+        self.hits = 0
+        self.precomputed_hits = 0
+        self.misses = 0
+        self._store: "OrderedDict[Tuple[str, str], torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+    def _get(self, key: Hashable):
+        with self._lock:
+            embedding = self._store.get(key)
+            if embedding is not None:
+                self._store.move_to_end(key)
+                self.hits += 1
+            return embedding
+
+    def _put(self, key: Hashable, embedding: torch.Tensor):
+        with self._lock:
+            self._store[key] = embedding
+            self._store.move_to_end(key)
+            while len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+
+    def get_text_matrix(self, prompt_list: List[str], clip_model, clip_processor) -> torch.Tensor:
+        """
+        Usage: Returns the normalized text-embedding matrix for the prompts, encoding only the ones not cached.
+        Inputs: List of prompts, the CLIP model and processor
+        Outputs: Tensor of shape [num_prompts, hidden_dim], rows in the order of prompt_list.
+        """
+        model_id = clip_model_id(clip_model)
+        keys = [(model_id, normalize_prompt(prompt)) for prompt in prompt_list]
+        embeddings = {key: self._get(key) for key in keys}
+
+        missing = list(dict.fromkeys(key for key, embedding in embeddings.items() if embedding is None))
+        if missing and self.precomputed is not None:
+            for key in list(missing):
+                embedding = self.precomputed.get(*key)
+                if embedding is not None:
+                    self._put(key, embedding)
+                    embeddings[key] = embedding
+                    missing.remove(key)
+                    with self._lock:
+                        self.precomputed_hits += 1
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            inputs = clip_processor(text=[prompt for _, prompt in missing], return_tensors="pt", padding=True)
+            with torch.no_grad(), metrics.stage("clip_text"):
+                text_features = as_embeddings(clip_model.get_text_features(**inputs))
+                text_features = F.normalize(text_features, p=2, dim=-1)
+            for key, embedding in zip(missing, text_features):
+                self._put(key, embedding)
+                embeddings[key] = embedding
+
+        return torch.stack([embeddings[key] for key in keys])
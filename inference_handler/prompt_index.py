@@ -0,0 +1,114 @@
+from typing import Dict, List, Optional, Tuple
+from inference_handler.prompt_cache import clip_model_id
+from inference_handler.prompt_search import PromptSearchIndex
+import torch
+
+
+class PromptIndex:
+    """
+    Flat index of every gating prompt, built once from the registered models.
+    Row i of the index holds prompts[i], the id of the model it selects (prompt_model_ids[i])
+    and the YOLO class id it stands for (prompt_class_ids[i], -1 for model-level prompts),
+    so a significance mask over the prompts maps straight to the models to run.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, int]]):
+        self.prompts = [prompt for prompt, _, _ in entries]
+        self.model_names = list(dict.fromkeys(model_name for _, model_name, _ in entries))
+
+        model_ids = {model_name: idx for idx, model_name in enumerate(self.model_names)}
+        self.prompt_model_ids = torch.tensor([model_ids[model_name] for _, model_name, _ in entries], dtype=torch.long)
+        self.prompt_class_ids = torch.tensor([class_id for _, _, class_id in entries], dtype=torch.long)
+        self.prompt_to_model_dict = {prompt: model_name for prompt, model_name, _ in entries}
+
+        # Stacked text-embedding matrix and similarity search index per CLIP checkpoint:
+        self._text_features: Dict[str, torch.Tensor] = {}
+        self._search_indexes: Dict[str, PromptSearchIndex] = {}
+
+    def __len__(self) -> int:
+        return len(self.prompts)
+
+    @classmethod
+    def from_text_prompts(cls, text_prompts: Dict[str, List[str]],
+                          label_prompts: Optional[Dict[str, Dict[int, str]]] = None) -> "PromptIndex":
+        """
+        Usage: Build the index from the per-model prompts in config["text_prompts"] and, optionally,
+        the per-class prompts of each model (see get_label_prompts).
+        Inputs:
+        - text_prompts: Dictionary of model name -> list of prompts that select the whole model.
+        - label_prompts: Dictionary of model name -> {class id: prompt}.
+        Outputs: A PromptIndex.
+        """
+        entries = []
+        for model_name, prompts in text_prompts.items():
+            for prompt in prompts:
+                entries.append((prompt, model_name, -1))
+
+        for model_name, class_prompts in (label_prompts or {}).items():
+            for class_id, prompt in class_prompts.items():
+                entries.append((prompt, model_name, int(class_id)))
+
+        return cls(entries)
+
+    def text_matrix(self, clip_model, clip_processor, prompt_cache) -> torch.Tensor:
+        """
+        Usage: Returns the normalized text features of all indexed prompts, encoding them on first use.
+        When the precomputed embedding file of the prompt cache holds exactly the rows of the index,
+        the matrix is converted from it at once, without going through the per-prompt cache.
+        Outputs: Tensor of shape [num_prompts, hidden_dim].
+        """
+        model_id = clip_model_id(clip_model)
+        text_features = self._text_features.get(model_id)
+        if text_features is None:
+            store = prompt_cache.precomputed
+            if store is not None and store.matches(self, model_id):
+                text_features = store.text_matrix()
+            else:
+                text_features = prompt_cache.get_text_matrix(self.prompts, clip_model, clip_processor)
+            self._text_features[model_id] = text_features
+        return text_features
+
+    def search_index(self, clip_model, clip_processor, prompt_cache, **params) -> PromptSearchIndex:
+        """
+        Usage: Returns the similarity search index over all indexed prompts, building it on first use.
+        Inputs: The CLIP model and processor, the prompt cache, PromptSearchIndex parameters
+        Outputs: A PromptSearchIndex (exact below params["exact_threshold"] prompts, IVF above it).
+        """
+        model_id = clip_model_id(clip_model)
+        search_index = self._search_indexes.get(model_id)
+        if search_index is None:
+            search_index = PromptSearchIndex(self.text_matrix(clip_model, clip_processor, prompt_cache), **params)
+            self._search_indexes[model_id] = search_index
+        return search_index
+
+    def classes_for(self, significant_mask: torch.Tensor) -> Dict[str, Optional[List[int]]]:
+        """
+        Usage: Turn a boolean significance mask over the indexed prompts into the models to run and,
+        for each of them, the YOLO class ids whose prompts were significant.
+        A significant model-level prompt selects all classes of its model (None).
+        Inputs: Boolean tensor of shape [num_prompts]
+        Outputs: Dictionary of model name -> list of class ids or None, in registration order.
+        """
+        model_ids = self.prompt_model_ids[significant_mask]
+        class_ids = self.prompt_class_ids[significant_mask]
+
+        # One row per selected model, sorted by model id then class id:
+        pairs = torch.unique(torch.stack([model_ids, class_ids], dim=1), dim=0).tolist() if len(model_ids) else []
+
+        model_classes = {}
+        for model_id, class_id in pairs:
+            model_name = self.model_names[model_id]
+            if class_id < 0:
+                model_classes[model_name] = None
+            elif model_classes.get(model_name, []) is not None:
+                model_classes.setdefault(model_name, []).append(class_id)
+        return model_classes
+
+    def models_for(self, significant_mask: torch.Tensor) -> List[str]:
+        """
+        Usage: Turn a boolean significance mask over the indexed prompts into the names of the models to run.
+        Inputs: Boolean tensor of shape [num_prompts]
+        Outputs: List of model names, in registration order.
+        """
+        model_ids = torch.unique(self.prompt_model_ids[significant_mask])
+        return [self.model_names[idx] for idx in model_ids.tolist()]
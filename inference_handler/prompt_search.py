@@ -0,0 +1,126 @@
+from typing import Optional, Tuple
+import math
+import torch
+from inference_handler.prediction_handler import significant_prompts
+
+SIGNIFICANT_Z = 0.2
+SIGNIFICANT_FRACTION_OF_TOP = 0.8
+
+
+class PromptSearchIndex:
+    """
+    Similarity search over the normalized text features of a large prompt vocabulary.
+    Up to exact_threshold prompts every similarity is computed (brute force). Above it, the prompts are
+    clustered by spherical k-means into nlist inverted lists (IVF) and a query only scores the prompts of
+    its nprobe closest lists; nprobe is the recall-vs-latency knob (nprobe = nlist is exact).
+
+    The significance rule z-scores every similarity by the mean and standard deviation over all prompts.
+    Both are exact without scoring every prompt: the mean is q . mean(t) and the variance follows from
+    the second-moment matrix of the text features, q^T (T^T T / N) q - mean^2. Only the ranking is approximate.
+    """
+
+    def __init__(self, text_features: torch.Tensor, top_k: int = 64, exact_threshold: int = 4096,
+                 nlist: Optional[int] = None, nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        self.text_features = text_features.float()
+        self.num_prompts = len(self.text_features)
+        self.top_k = top_k
+        self.nprobe = nprobe
+        self.exact = self.num_prompts <= exact_threshold
+
+        self.mean_feature = self.text_features.mean(dim=0)  # [hidden_dim]
+        self.second_moment = self.text_features.T @ self.text_features / self.num_prompts  # [hidden_dim, hidden_dim]
+
+        if not self.exact:
+            self.nlist = nlist or max(1, int(4 * math.sqrt(self.num_prompts)))
+            self._build_lists(iterations, seed)
+
+    def __len__(self) -> int:
+        return self.num_prompts
+
+    def _build_lists(self, iterations: int, seed: int):
+        generator = torch.Generator().manual_seed(seed)
+        features = self.text_features
+        centroids = features[torch.randperm(self.num_prompts, generator=generator)[:self.nlist]].clone()
+
+        for _ in range(iterations):
+            assignment = self._assign(centroids)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, features)
+            counts = torch.bincount(assignment, minlength=len(centroids))
+            # Empty lists keep their centroid, the others move to the normalized mean of their members:
+            centroids = torch.where(counts[:, None] > 0, torch.nn.functional.normalize(sums, dim=-1), centroids)
+
+        assignment = self._assign(centroids)
+        order = torch.argsort(assignment, stable=True)
+        counts = torch.bincount(assignment, minlength=len(centroids))
+
+        self.centroids = centroids  # [nlist, hidden_dim]
+        # Members of list l are rows offsets[l]:offsets[l + 1] of the reordered features:
+        self.list_ids = order
+        self.list_features = features[order]
+        self.offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(counts, dim=0)]).tolist()
+
+    def _assign(self, centroids: torch.Tensor, chunk_size: int = 8192) -> torch.Tensor:
+        return torch.cat([
+            (self.text_features[start:start + chunk_size] @ centroids.T).argmax(dim=-1)
+            for start in range(0, self.num_prompts, chunk_size)
+        ])
+
+    def statistics(self, image_features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Usage: Exact mean and (unbiased, as torch.std) standard deviation of every query's similarities to all prompts.
+        Outputs: Two tensors [num_images].
+        """
+        mean = image_features @ self.mean_feature
+        variance = ((image_features @ self.second_moment) * image_features).sum(dim=-1) - mean ** 2
+        variance = variance.clamp_min(0) * self.num_prompts / max(self.num_prompts - 1, 1)
+        return mean, variance.sqrt()
+
+    def search(self, image_features: torch.Tensor, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Usage: The k most similar prompts of every query, exact below exact_threshold and IVF above it.
+        Inputs: Normalized image features [num_images, hidden_dim]
+        Outputs: Similarities and prompt indices, both [num_images, k'] with k' = min(k, candidates), most similar first.
+        """
+        k = min(k, self.num_prompts)
+        if self.exact:
+            return torch.topk(image_features @ self.text_features.T, k, dim=-1)
+
+        probes = torch.topk(image_features @ self.centroids.T, min(self.nprobe, self.nlist), dim=-1).indices.tolist()
+        candidate_ids = []
+        candidate_sims = []
+        for query, lists in zip(image_features, probes):
+            ranges = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            rows = torch.cat([torch.arange(start, end) for start, end in ranges])
+            candidate_sims.append(self.list_features[rows] @ query)
+            candidate_ids.append(self.list_ids[rows])
+
+        k = min(k, min(len(ids) for ids in candidate_ids))
+        sims, ids = [], []
+        for query_sims, query_ids in zip(candidate_sims, candidate_ids):
+            top = torch.topk(query_sims, k)
+            sims.append(top.values)
+            ids.append(query_ids[top.indices])
+        return torch.stack(sims), torch.stack(ids)
+
+    def significant_prompts(self, image_features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Usage: The gating rule of prediction_handler.significant_prompts over the top_k prompts of each query:
+        a prompt is significant if its z-score is above 0.2 or its probability is at least 0.8 times that of
+        the best prompt. Exact below exact_threshold (every prompt is scored); above it, at most top_k prompts
+        per image can be significant and prompts outside the searched lists get probability 0.
+        Inputs: Normalized image features [num_images, hidden_dim]
+        Outputs: Tuple of probabilities and a boolean significance mask, both [num_images, num_prompts].
+        """
+        if self.exact:
+            return significant_prompts(image_features @ self.text_features.T)
+
+        sims, ids = self.search(image_features, self.top_k)
+        mean, std = self.statistics(image_features)
+
+        z = (sims - mean[:, None]) / std[:, None]
+        top_probs = torch.sigmoid(z)
+        top_mask = (z > SIGNIFICANT_Z) | (top_probs >= SIGNIFICANT_FRACTION_OF_TOP * top_probs[:, :1])
+
+        probs = torch.zeros(len(image_features), self.num_prompts).scatter_(1, ids, top_probs)
+        mask = torch.zeros(len(image_features), self.num_prompts, dtype=torch.bool).scatter_(1, ids, top_mask)
+        return probs, mask
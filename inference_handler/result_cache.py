@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from typing import Any, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def result_key(image_bytes: bytes, *parts) -> str:
+    """
+    Usage: Content address of a request: a hash of the uploaded bytes and everything else the result depends on.
+    Inputs: The raw image bytes, any JSON-serializable request parameters (prompts, model version, confidence, ...)
+    Outputs: Hex digest (string).
+    """
+    digest = hashlib.blake2b(image_bytes, digest_size=16)
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_version(paths) -> str:
+    """
+    Usage: Version string of a set of files (e.g. model weights), which changes whenever one of them
+    is added, removed, or rewritten.
+    """
+    stats = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+            stats.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stats.append((path, None, None))
+    return hashlib.blake2b(json.dumps(stats).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of JSON-serializable endpoint responses keyed by result_key.
+    The memory tier is an LRU of at most max_entries results. The optional disk tier stores one JSON
+    file per result in disk_dir, expiring entries after disk_ttl_seconds and deleting the oldest files
+    once the directory grows beyond disk_max_mb. A disabled cache never hits and stores nothing.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None, disk_ttl_seconds: float = 86400,
+                 disk_max_mb: float = 512, enabled: bool = True):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._store: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.enabled and self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Usage: Returns the cached result for key, or None. Disk hits are promoted to the memory tier.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            result = self._store.get(key)
+            if result is not None:
+                self._store.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, result)
+        return result
+
+    def put(self, key: str, result: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._put_memory(key, result)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def invalidate(self):
+        """
+        Usage: Drop every entry of both tiers, e.g. after the model registry changed.
+        """
+        with self._lock:
+            self._store.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith(".json"):
+                    _remove(entry.path)
+
+    def _put_memory(self, key: str, result: Any):
+        self._store[key] = result
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.disk_ttl_seconds:
+                _remove(path)
+                return None
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, result: Any):
+        # Written to a temporary file and renamed, so that readers never see a partial entry:
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(result, file)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError, ValueError):
+            _remove(tmp_path)
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """
+        Usage: Delete expired entries, then the oldest ones until the disk tier fits in disk_max_mb.
+        """
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.disk_ttl_seconds:
+                _remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        # Already removed by a concurrent request:
+        pass
@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from PIL import Image
+import copy
+import hashlib
+import cv2
+import numpy as np
+import torch
+
+
+def layer_signatures(model) -> List[str]:
+    """
+    Usage: Cumulative fingerprint of every layer of a YOLO detection model: entry i hashes the type,
+    the inputs and the weights of layers 0..i. Two models compute identical features up to layer i
+    exactly when their signatures agree at i, e.g. detectors fine-tuned from one base with a frozen backbone.
+    Inputs: An ultralytics YOLO model
+    Outputs: List of hex digests, one per layer.
+    """
+    layers = model.model.model
+    digest = hashlib.blake2b(digest_size=16)
+    signatures = []
+    for layer in layers:
+        digest.update(f"{type(layer).__name__}:{layer.f}".encode("utf-8"))
+        for name, tensor in layer.state_dict().items():
+            digest.update(name.encode("utf-8"))
+            digest.update(tensor.detach().cpu().numpy().tobytes())
+        signatures.append(digest.copy().hexdigest())
+    return signatures
+
+
+def shared_prefix(signatures: Sequence[str], other: Sequence[str]) -> int:
+    """
+    Usage: Number of leading layers two models share (see layer_signatures).
+    """
+    count = 0
+    for signature, other_signature in zip(signatures, other):
+        if signature != other_signature:
+            break
+        count += 1
+    return count
+
+
+def plan_shared_runs(names: List[str], signatures: Dict[str, Optional[List[str]]],
+                     min_shared_layers: int = 1) -> Tuple[List[Tuple[int, List[str]]], List[str]]:
+    """
+    Usage: Group the selected models by shared leading layers.
+    Every group shares at least min_shared_layers layers (the detection head itself is never shared);
+    models without a partner, or without signatures, are returned for separate runs.
+    Outputs: Tuple of [(number of shared layers, model names)] groups and the remaining model names.
+    """
+    groups, separate = [], []
+    remaining = [name for name in names if signatures.get(name)]
+    separate.extend(name for name in names if not signatures.get(name))
+
+    while remaining:
+        reference = remaining.pop(0)
+        reference_signatures = signatures[reference]
+        members, prefix = [reference], len(reference_signatures) - 1
+
+        for name in list(remaining):
+            common = shared_prefix(reference_signatures, signatures[name])
+            if common >= min_shared_layers:
+                members.append(name)
+                remaining.remove(name)
+                prefix = min(prefix, common)
+
+        if len(members) > 1:
+            groups.append((prefix, members))
+        else:
+            separate.append(reference)
+    return groups, separate
+
+
+def _run_layer(layer, x, outputs):
+    if layer.f != -1:
+        x = outputs[layer.f] if isinstance(layer.f, int) else [x if j == -1 else outputs[j] for j in layer.f]
+    return layer(x)
+
+
+def run_shared(image, models: Dict[str, object], prefix: int, confidence: float,
+               model_classes: Optional[Dict[str, Optional[List[int]]]] = None) -> Dict[str, object]:
+    """
+    Usage: Detect with several YOLO models that share their first prefix layers: the image is letterboxed
+    once, the shared layers run once, and only the remaining layers (neck and head) run per model.
+    Pre- and post-processing (letterbox, NMS, box scaling) are those of each model's own predictor, so
+    the models must have run once before (see predictor_ready).
+    Inputs: The image (PIL or BGR array), the models keyed by name, the number of shared layers,
+    the confidence threshold and, optionally, the class ids to keep per model.
+    Outputs: Dictionary of model name -> ultralytics Results.
+    """
+    if model_classes is None:
+        model_classes = {}
+    if isinstance(image, Image.Image):
+        image = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+    first = next(iter(models.values())).predictor
+    batch = first.preprocess([image])
+
+    results = {}
+    with torch.inference_mode():
+        x, outputs = batch, []
+        for layer in first.model.model.model[:prefix]:
+            x = _run_layer(layer, x, outputs)
+            outputs.append(x)
+
+        for name, model in models.items():
+            # A private copy of the predictor and its arguments, the model's own predictor is shared with
+            # concurrent predict calls and never modified here:
+            predictor = copy.copy(model.predictor)
+            predictor.args = copy.copy(predictor.args)
+            head_x, head_outputs = x, list(outputs)
+            for layer in predictor.model.model.model[prefix:]:
+                head_x = _run_layer(layer, head_x, head_outputs)
+                head_outputs.append(head_x)
+
+            predictor.args.conf = confidence
+            predictor.args.classes = model_classes.get(name)
+            predictor.batch = (["image0.jpg"], [image], [""])
+            results[name] = predictor.postprocess(head_x, batch, [image])[0]
+    return results
+
+
+def predictor_ready(models: Sequence) -> bool:
+    """
+    Usage: Whether the models have set up their predictors (with the same input size), which happens on
+    their first predict call.
+    """
+    predictors = [getattr(model, "predictor", None) for model in models]
+    if any(predictor is None or getattr(predictor, "model", None) is None for predictor in predictors):
+        return False
+    return len({tuple(np.atleast_1d(predictor.imgsz)) for predictor in predictors}) == 1
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+from PIL import Image
+import threading
+import cv2
+import numpy as np
+
+
+def frame_signature(image, size: Tuple[int, int] = (32, 32), bgr: bool = False) -> np.ndarray:
+    """
+    Usage: Cheap scene signature of a frame: a small grayscale thumbnail scaled to [0, 1].
+    Inputs: PIL image or RGB image (BGR when bgr is set) as a NumPy array, the thumbnail size
+    Outputs: float32 array of shape size.
+    """
+    if isinstance(image, Image.Image):
+        thumbnail = np.asarray(image.convert("L").resize(size, Image.BOX))
+    else:
+        image = np.asarray(image)
+        # Averaging every pixel of a large frame costs more than the rest of the signature put together;
+        # a strided view keeping about four samples per thumbnail pixel and axis is nearly as smooth:
+        step = max(1, min(image.shape[0] // (4 * size[1]), image.shape[1] // (4 * size[0])))
+        image = np.ascontiguousarray(image[::step, ::step])
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+        thumbnail = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return thumbnail.astype(np.float32) / 255.0
+
+
+def scene_change(signature: np.ndarray, reference: np.ndarray) -> float:
+    """
+    Usage: Mean absolute difference between two frame signatures, 0 for identical frames and 1 at most.
+    """
+    return float(np.abs(signature - reference).mean())
+
+
+class TemporalGateCache:
+    """
+    Reuses the result computed for a keyframe (the CLIP gating decision, or the YOLO boxes) on the
+    following frames of the same stream until the scene moves more than threshold away from the keyframe
+    or the result has been reused max_age times. Entries are keyed by the caller (e.g. session id and prompts)
+    and at most max_entries streams are tracked. A disabled cache never hits and stores nothing.
+    """
+
+    def __init__(self, threshold: float = 0.04, max_age: int = 30, max_entries: int = 256,
+                 signature_size: Tuple[int, int] = (32, 32), enabled: bool = True):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.signature_size = signature_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: Hashable, image: np.ndarray) -> Tuple[Optional[Any], np.ndarray]:
+        """
+        Usage: Returns the cached result for the stream if the scene has not changed, and the frame signature
+        (to be passed on to store() on a miss).
+        Inputs: The stream key, the frame as a PIL image or RGB NumPy array
+        Outputs: Tuple of the cached result (None on a miss) and the frame signature.
+        """
+        if not self.enabled:
+            return None, None
+
+        signature = frame_signature(image, self.signature_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                reference, result, age = entry
+                if age < self.max_age and scene_change(signature, reference) <= self.threshold:
+                    entry[2] += 1
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result, signature
+            self.misses += 1
+            return None, signature
+
+    def store(self, key: Hashable, signature: np.ndarray, result: Any):
+        """
+        Usage: Make the frame with this signature the keyframe of the stream and cache its result.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = [signature, result, 0]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop(self, session_id: Hashable):
+        """
+        Usage: Forget every stream of a session, e.g. when its client disconnects.
+        Keys are expected to be tuples starting with the session id.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if isinstance(key, tuple) and key[0] == session_id]:
+                del self._entries[key]
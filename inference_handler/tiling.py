@@ -0,0 +1,87 @@
+from typing import List, Tuple
+from PIL import Image
+import numpy as np
+import torch
+
+AGGREGATIONS = ("max", "softmax")
+
+
+def tile_boxes(width: int, height: int, rows: int, cols: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    Usage: Boxes of a rows x cols grid of equally sized tiles covering the image, where neighbouring
+    tiles share overlap (a fraction of the tile size) along each axis.
+    Outputs: List of (left, top, right, bottom) boxes, row by row.
+    """
+    tile_width = width / (cols - (cols - 1) * overlap)
+    tile_height = height / (rows - (rows - 1) * overlap)
+    step_x = tile_width * (1 - overlap)
+    step_y = tile_height * (1 - overlap)
+
+    boxes = []
+    for row in range(rows):
+        for col in range(cols):
+            left, top = round(col * step_x), round(row * step_y)
+            boxes.append((left, top, min(width, round(left + tile_width)), min(height, round(top + tile_height))))
+    return boxes
+
+
+class TileGrid:
+    """
+    Tiled CLIP gating for high-resolution frames: every image is scored as the global view plus a
+    rows x cols grid of overlapping crops, so that small objects (potholes, cones, cracks) cover enough
+    of a CLIP input to be seen. All views go through the image encoder in the same batch and the
+    per-prompt similarities are aggregated across the views of each image, either by max or by a
+    soft-max (temperature-scaled log-sum-exp, which approaches max as temperature goes to 0).
+    """
+
+    def __init__(self, rows: int = 2, cols: int = 2, overlap: float = 0.25, aggregate: str = "max",
+                 temperature: float = 0.01, include_global: bool = True):
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f"Unknown tile aggregation '{aggregate}', expected one of {AGGREGATIONS}")
+        if not 0 <= overlap < 1:
+            raise ValueError("Tile overlap must be in [0, 1)")
+
+        self.rows = rows
+        self.cols = cols
+        self.overlap = overlap
+        self.aggregate_mode = aggregate
+        self.temperature = temperature
+        self.include_global = include_global
+
+    @property
+    def views_per_image(self) -> int:
+        return self.rows * self.cols + int(self.include_global)
+
+    def views(self, image) -> list:
+        """
+        Usage: The global view (if enabled) followed by the tiles of one image.
+        Tiles of arrays are views into the frame, not copies.
+        Inputs: PIL image or RGB array
+        Outputs: List of views_per_image images of the same type.
+        """
+        if isinstance(image, Image.Image):
+            width, height = image.size
+            crop = image.crop
+        else:
+            image = np.asarray(image)
+            height, width = image.shape[:2]
+            crop = lambda box: image[box[1]:box[3], box[0]:box[2]]
+
+        views = [image] if self.include_global else []
+        views.extend(crop(box) for box in tile_boxes(width, height, self.rows, self.cols, self.overlap))
+        return views
+
+    def expand(self, images) -> list:
+        return [view for image in images for view in self.views(image)]
+
+    def aggregate(self, sims: torch.Tensor) -> torch.Tensor:
+        """
+        Usage: Collapse the similarities of all views of each image into one row per image.
+        Inputs: Tensor [num_images * views_per_image, num_classes], views of an image in consecutive rows
+        Outputs: Tensor [num_images, num_classes].
+        """
+        sims = sims.reshape(-1, self.views_per_image, sims.shape[-1])
+        if self.aggregate_mode == "max":
+            return sims.max(dim=1).values
+        # Normalized so that identical views aggregate to their own similarity:
+        return self.temperature * (torch.logsumexp(sims / self.temperature, dim=1) - np.log(self.views_per_image))
@@ -0,0 +1,36 @@
+"""
+Torch intra-op thread budgets of the threads that run inference.
+
+torch.set_num_threads applies to the calling thread, but it also becomes the default of every thread started
+afterwards. A thread pool that lowers the budget of its own threads therefore lowers it for the request,
+scheduler and batching threads that start later. Every thread that runs torch sets its own budget when it
+starts instead: the process budget, or a share of it (e.g. the YOLO pool, cores / workers).
+"""
+from typing import Optional
+import torch
+
+_process_threads = torch.get_num_threads()
+
+
+def process_threads() -> int:
+    """
+    Usage: The intra-op thread budget of the whole process.
+    """
+    return _process_threads
+
+
+def set_process_threads(threads: int):
+    """
+    Usage: Sets the budget of the process (e.g. in a worker process) and of the calling thread.
+    """
+    global _process_threads
+    _process_threads = threads
+    torch.set_num_threads(threads)
+
+
+def use_threads(threads: Optional[int] = None):
+    """
+    Usage: Sets the budget of the calling thread, by default the process budget.
+    Meant as the initializer of thread pools that run torch.
+    """
+    torch.set_num_threads(threads or _process_threads)
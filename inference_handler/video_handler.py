@@ -0,0 +1,147 @@
+from typing import Iterator, List, Optional, Tuple
+from inference_handler.output_handler import draw_prompt_lines, prompt_lines
+from inference_handler.prediction_handler import return_top_prompts_batch
+from inference_handler.temporal_cache import frame_signature, scene_change
+from inference_handler.metrics import metrics
+import os
+import time
+import cv2
+import numpy as np
+
+
+DEFAULT_FPS = 30.0
+
+
+def source_fps(video_path: str, default: float = DEFAULT_FPS) -> float:
+    """
+    Usage: Frame rate of a video file, or default when the container does not report one.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    try:
+        fps = vidcap.get(cv2.CAP_PROP_FPS)
+    finally:
+        vidcap.release()
+    return fps if fps and fps > 0 and np.isfinite(fps) else default
+
+
+def keyframe_gap(max_gap_seconds: float, fps: float) -> int:
+    """
+    Usage: The maximum keyframe gap in frames for a video at fps frames per second (at least 1).
+    """
+    return max(1, int(round(max_gap_seconds * fps)))
+
+
+def iter_sampled_frames(video_path: str, change_threshold: float = 0.04, max_gap: int = 60,
+                        signature_size: Tuple[int, int] = (32, 32)) -> Iterator[Tuple[np.ndarray, bool]]:
+    """
+    Usage: Lazily decode every frame of a video and flag the keyframes to gate.
+    A frame is a keyframe when its thumbnail (temporal_cache.frame_signature) moved more than change_threshold
+    away from the previous keyframe, or when max_gap frames went by since it; the first frame always is one.
+    Comparing against the keyframe rather than the previous frame also catches slow drifts (pans, fades).
+    Frames stay in the BGR layout of the decoder, which is also the layout the encoder takes.
+    Inputs: Path of the video file, the change threshold, the maximum keyframe gap in frames, the thumbnail size
+    Outputs: Generator of (BGR frame as NumPy array, is_keyframe) tuples.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    reference = None
+    gap = 0
+
+    try:
+        while True:
+            success, image = vidcap.read()
+            if not success:
+                break
+
+            with metrics.stage("sample"):
+                signature = frame_signature(image, signature_size, bgr=True)
+                keyframe = reference is None or gap >= max_gap or scene_change(signature, reference) > change_threshold
+
+            if keyframe:
+                reference = signature
+                gap = 0
+            gap += 1
+            yield image, keyframe
+    finally:
+        vidcap.release()
+
+
+def process_video(video_path, output_path, prompt_list, clip_model, clip_processor,
+                  change_threshold=0.04, max_gap_seconds=2.0, batch_size=16, max_buffered_frames=64,
+                  prompt_cache=None, tiling=None) -> int:
+    """
+    Usage: Streaming decode -> sample -> gate -> annotate -> encode pipeline for a video file.
+    Only the keyframes of iter_sampled_frames are gated, in batches of at most batch_size; every other frame
+    carries the prompt lines of the last keyframe before it, drawn straight onto the decoded frame.
+    Every frame is written, at the frame rate of the input, so the output keeps the timing of the source.
+    Frames wait in memory until the keyframes before them are gated: a batch is gated early once
+    max_buffered_frames frames are pending.
+    Inputs: Input and output video paths, the text-prompts, the CLIP model and processor, the sampling threshold
+    and maximum keyframe gap in seconds, the gating batch size, the frame buffer bound and, optionally, a TileGrid.
+    Outputs: Number of frames written to output_path.
+    """
+    fps = source_fps(video_path)
+    writer = None
+    frame_count = 0
+    # Pending BGR frames with the position of their keyframe in the batch (None for carried frames):
+    pending: List[Tuple[np.ndarray, Optional[int]]] = []
+    keyframes: List[np.ndarray] = []
+    lines = []
+
+    def flush():
+        nonlocal writer, frame_count, lines
+        batch_prompt_to_prob = return_top_prompts_batch(
+            keyframes, prompt_list,
+            clip_model, clip_processor, batch_size, prompt_cache, tiling
+        ) if keyframes else []
+
+        for frame, keyframe_index in pending:
+            if keyframe_index is not None:
+                lines = prompt_lines(batch_prompt_to_prob[keyframe_index])
+
+            with metrics.stage("annotate"):
+                annotated_frame = draw_prompt_lines(frame, lines)
+
+            if writer is None:
+                height, width, _ = annotated_frame.shape
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+            with metrics.stage("encode"):
+                writer.write(annotated_frame)
+            frame_count += 1
+
+        pending.clear()
+        keyframes.clear()
+
+    try:
+        for frame, keyframe in iter_sampled_frames(video_path, change_threshold, keyframe_gap(max_gap_seconds, fps)):
+            if keyframe:
+                pending.append((frame, len(keyframes)))
+                # Only the gated frames are converted to RGB for CLIP:
+                keyframes.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            else:
+                pending.append((frame, None))
+
+            if len(keyframes) == batch_size or len(pending) >= max_buffered_frames:
+                flush()
+        flush()
+    finally:
+        if writer is not None:
+            writer.release()
+
+    return frame_count
+
+
+def prune_videos(video_dir: str, max_age_seconds: float):
+    """
+    Usage: Delete annotated videos older than max_age_seconds from video_dir.
+    """
+    now = time.time()
+    for filename in os.listdir(video_dir):
+        path = os.path.join(video_dir, filename)
+        try:
+            if now - os.path.getmtime(path) > max_age_seconds:
+                os.remove(path)
+        except OSError:
+            # Already removed by a concurrent request:
+            continue
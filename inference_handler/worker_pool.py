@@ -0,0 +1,243 @@
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional
+import itertools
+import multiprocessing as mp
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection, wait
+import os
+import pickle
+import signal
+import socket
+import threading
+from inference_handler.torch_threads import set_process_threads
+
+
+def _worker_main(tasks, results, handlers: Dict[str, Callable], threads: int):
+    # Forked children inherit the loaded models; only the intra-op thread count is set per worker:
+    set_process_threads(threads)
+    while True:
+        try:
+            task = tasks.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        task_id, name, args = task
+        try:
+            payload = pickle.dumps((True, handlers[name](*args)))
+        except Exception as error:
+            try:
+                payload = pickle.dumps((False, error))
+            except Exception:
+                payload = pickle.dumps((False, RuntimeError(repr(error))))
+        results.send((task_id, payload))
+
+
+def _zygote_main(commands: socket.socket, parent_commands: socket.socket, handlers: Dict[str, Callable], threads: int):
+    """
+    Forks the inference workers on request. The zygote itself never starts a thread, so a worker forked
+    long after startup (to replace one that died) cannot inherit a lock held by a thread of the server.
+    For each request it sends back the worker pid and the parent ends of the worker's task and result pipes.
+    """
+    # The parent's end is inherited by the fork, closing it lets the zygote see the parent close its own:
+    parent_commands.close()
+    # Workers are children of the zygote, reaped without waiting for them:
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while commands.recv(1):
+        task_receiver, task_sender = Pipe(duplex=False)
+        result_receiver, result_sender = Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            commands.close()
+            task_sender.close()
+            result_receiver.close()
+            code = 0
+            try:
+                _worker_main(task_receiver, result_sender, handlers, threads)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+
+        task_receiver.close()
+        result_sender.close()
+        socket.send_fds(commands, [pid.to_bytes(8, "little")], [task_sender.fileno(), result_receiver.fileno()])
+        task_sender.close()
+        result_receiver.close()
+
+
+def _report_replay_failure(future: Future):
+    if future.exception() is not None:
+        print(f"Replaying a broadcast to a new inference worker failed: {future.exception()}")
+
+
+class WorkerPool:
+    """
+    Pool of inference processes forked from the server process after the model weights are loaded,
+    so the weight pages are shared copy-on-write instead of being loaded once per process.
+    Tasks are looked up by name in handlers (functions of the parent, inherited by the fork) and sent to
+    the worker with the fewest tasks in flight; arguments and results must be picklable. Each worker runs
+    torch with threads intra-op threads. A worker that dies fails its pending tasks and is replaced.
+    Every worker, including the replacements, is forked by a zygote process forked when the pool is created,
+    before the pool starts any thread. The zygote holds the state of the server at that time, so the broadcasts
+    of the tasks named in replayed (e.g. model registrations) are recorded and sent to every replacement, in order,
+    before any other task.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable], processes: int = 2, threads: Optional[int] = None,
+                 replayed: Iterable[str] = ()):
+        self.handlers = handlers
+        self.replayed = set(replayed)
+        self.processes = processes
+        self.threads = threads or max(1, (os.cpu_count() or 1) // processes)
+        self.restarts = 0
+        self.pids: List[int] = [0] * processes
+        self._tasks: List = [None] * processes
+        self._results: List = [None] * processes
+        self._send_locks = [threading.Lock() for _ in range(processes)]
+        self._inflight = [0] * processes
+        self._futures: Dict[int, tuple] = {}
+        self._history: List[tuple] = []
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._commands, zygote_commands = socket.socketpair()
+        self._zygote = mp.get_context("fork").Process(
+            target=_zygote_main, args=(zygote_commands, self._commands, handlers, self.threads), daemon=True
+        )
+        self._zygote.start()
+        zygote_commands.close()
+
+        for index in range(processes):
+            self._start_worker(index)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, index: int):
+        # Every worker has its own pipes, so a killed worker cannot leave a shared lock held:
+        self._commands.sendall(b"w")
+        data, fds, _, _ = socket.recv_fds(self._commands, 8, 2)
+        self.pids[index] = int.from_bytes(data, "little")
+        self._tasks[index] = Connection(fds[0], readable=False)
+        self._results[index] = Connection(fds[1], writable=False)
+
+    def _register(self, index: int) -> tuple:
+        # Called with the lock held, the task is sent after releasing it:
+        future = Future()
+        task_id = next(self._task_ids)
+        self._futures[task_id] = (future, index)
+        self._inflight[index] += 1
+        return future, task_id, self._tasks[index]
+
+    def _send(self, index: int, future: Future, task_id: int, tasks, name: str, args: tuple):
+        try:
+            # Sending blocks until the worker has read a large task, only other tasks for this worker wait:
+            with self._send_locks[index]:
+                tasks.send((task_id, name, args))
+        except OSError as error:
+            # The worker exited, it is replaced by the collector:
+            with self._lock:
+                if self._futures.pop(task_id, None) is not None:
+                    self._inflight[index] -= 1
+                    future.set_exception(RuntimeError(f"Inference worker exited: {error}"))
+
+    def submit(self, name: str, *args) -> Future:
+        """
+        Usage: Run handlers[name](*args) on the least busy worker.
+        Outputs: A Future of the handler's return value.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Worker pool is closed")
+            index = min(range(self.processes), key=self._inflight.__getitem__)
+            future, task_id, tasks = self._register(index)
+        self._send(index, future, task_id, tasks, name, args)
+        return future
+
+    def run(self, name: str, *args):
+        return self.submit(name, *args).result()
+
+    def broadcast(self, name: str, *args) -> list:
+        """
+        Usage: Run handlers[name](*args) once on every worker (e.g. to register a new model) and wait for all of them.
+        """
+        with self._lock:
+            if name in self.replayed:
+                self._history.append((name, args))
+            registered = [(index, *self._register(index)) for index in range(self.processes)]
+        for index, future, task_id, tasks in registered:
+            self._send(index, future, task_id, tasks, name, args)
+        return [future.result() for _, future, _, _ in registered]
+
+    def _collect(self):
+        while not self._closed:
+            with self._lock:
+                receivers = {receiver: index for index, receiver in enumerate(self._results)}
+
+            for receiver in wait(list(receivers), timeout=1.0):
+                try:
+                    task_id, payload = receiver.recv()
+                except (EOFError, OSError):
+                    self._replace_worker(receivers[receiver])
+                    continue
+
+                with self._lock:
+                    future, index = self._futures.pop(task_id, (None, None))
+                    if future is not None:
+                        self._inflight[index] -= 1
+                if future is None:
+                    continue
+
+                ok, value = pickle.loads(payload)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _replace_worker(self, index: int):
+        """
+        Fails the pending tasks of a worker whose result pipe closed (it exited) and forks a new one.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            lost = [task_id for task_id, (_, owner) in self._futures.items() if owner == index]
+            for task_id in lost:
+                future, _ = self._futures.pop(task_id)
+                future.set_exception(RuntimeError(f"Inference worker {self.pids[index]} exited"))
+            self._inflight[index] = 0
+            self._results[index].close()
+            with self._send_locks[index]:
+                self._tasks[index].close()
+            self.restarts += 1
+            self._start_worker(index)
+
+            # Sent before the lock is released, so the replacement runs them before any task submitted to it:
+            for name, args in self._history:
+                future, task_id, tasks = self._register(index)
+                future.add_done_callback(_report_replay_failure)
+                try:
+                    with self._send_locks[index]:
+                        tasks.send((task_id, name, args))
+                except OSError as error:
+                    # The replacement exited already, the collector replaces it again:
+                    self._futures.pop(task_id)
+                    self._inflight[index] -= 1
+                    future.set_exception(RuntimeError(f"Inference worker exited: {error}"))
+                    break
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for index, tasks in enumerate(self._tasks):
+                try:
+                    with self._send_locks[index]:
+                        tasks.send(None)
+                except OSError:
+                    continue
+            # The zygote exits once its command socket is closed:
+            self._commands.close()
+        self._zygote.join(timeout=5)
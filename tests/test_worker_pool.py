@@ -0,0 +1,109 @@
+"""
+/predict through the forked worker pool with several torch threads per worker.
+
+The server module runs in a fresh interpreter (so the thread settings apply before torch does any work),
+with tiny randomly initialized CLIP and YOLO models instead of the downloaded checkpoints.
+A worker that deadlocks on its first parallel op makes the request hang, and the test time out.
+"""
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+
+pytest.importorskip("ultralytics")
+pytest.importorskip("transformers")
+pytest.importorskip("flask_socketio")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_SCRIPT = textwrap.dedent('''
+    import io, json
+    import numpy as np
+    import torch
+    from PIL import Image
+    from transformers import CLIPConfig, CLIPModel
+    from ultralytics import YOLO
+
+    # Parallel torch work in the server process before the fork, as with the real checkpoints:
+    torch.set_num_threads(4)
+
+    class TinyProcessor:
+        class image_processor:
+            size = {"shortest_edge": 32}
+            crop_size = {"height": 32, "width": 32}
+            image_mean = [0.48145466, 0.4578275, 0.40821073]
+            image_std = [0.26862954, 0.26130258, 0.27577711]
+            do_resize = do_center_crop = do_normalize = do_rescale = True
+            rescale_factor = 1 / 255
+
+        def __call__(self, text=None, images=None, return_tensors="pt", padding=True):
+            outputs = {}
+            if text is not None:
+                ids = [[1] + [3 + ord(char) % 990 for char in prompt][:60] + [2] for prompt in text]
+                length = max(map(len, ids))
+                outputs["input_ids"] = torch.tensor([row + [0] * (length - len(row)) for row in ids])
+                outputs["attention_mask"] = torch.tensor([[1] * len(row) + [0] * (length - len(row)) for row in ids])
+            if images is not None:
+                images = images if isinstance(images, (list, tuple)) else [images]
+                pixels = [np.asarray(Image.fromarray(np.asarray(image)).convert("RGB").resize((32, 32)), dtype=np.float32) / 255
+                          for image in images]
+                pixels = [(pixel - self.image_processor.image_mean) / self.image_processor.image_std for pixel in pixels]
+                outputs["pixel_values"] = torch.tensor(np.stack(pixels).transpose(0, 3, 1, 2), dtype=torch.float32)
+            return outputs
+
+    def tiny_clip():
+        torch.manual_seed(0)
+        config = CLIPConfig(
+            text_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=2,
+                             vocab_size=1000, eos_token_id=2, bos_token_id=1, pad_token_id=0),
+            vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=2,
+                               image_size=32, patch_size=8),
+            projection_dim=16,
+        )
+        return CLIPModel(config).eval(), TinyProcessor()
+
+    import inference_handler.model_loader as model_loader
+    import utils.config_loader as config_loader
+
+    class TinyRegistry(model_loader.ModelRegistry):
+        def __init__(self, model_paths, **kwargs):
+            kwargs["loader"] = lambda path: YOLO("yolov8n.yaml")
+            super().__init__(model_paths, **kwargs)
+
+    load_config = config_loader.load_config
+    def pool_config(*args, **kwargs):
+        config = load_config(*args, **kwargs)
+        config["worker_pool"].update(processes=2, threads=2)
+        config["clip"]["embedding_index"] = "/nonexistent/prompt_embeddings.json"
+        return config
+
+    model_loader.ModelRegistry = TinyRegistry
+    model_loader.load_clip_model = tiny_clip
+    config_loader.load_config = pool_config
+
+    import app
+
+    image = io.BytesIO()
+    Image.fromarray((np.random.rand(240, 320, 3) * 255).astype(np.uint8)).save(image, format="JPEG")
+    client = app.app.test_client()
+
+    response = client.post("/predict", data={"image": (io.BytesIO(image.getvalue()), "a.jpg"),
+                                             "prompts": json.dumps(["a car", "a dog"])})
+    assert response.status_code == 200, response.data
+    response = client.post("/predict", data={"image": (io.BytesIO(image.getvalue()), "b.jpg"), "prompts": "[]"})
+    assert response.status_code == 200, response.data
+    assert sorted(set(app.worker_pool.broadcast("gate_prompts", np.zeros((64, 64, 3), np.uint8), ["a cat"])[0])) == ["a cat"]
+
+    app.worker_pool.close()
+    print("predicted through the worker pool")
+''')
+
+
+def test_predict_through_worker_pool_with_threads():
+    result = subprocess.run(
+        [sys.executable, "-c", SERVER_SCRIPT], cwd=REPO_DIR, env=dict(os.environ, OMP_NUM_THREADS="4"),
+        capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stderr[-4000:]
+    assert "predicted through the worker pool" in result.stdout